@@ -4,45 +4,153 @@ os.environ['EVENTLET_HUB'] = 'poll'
 import eventlet
 eventlet.monkey_patch()
 
+import re
 import uuid 
+import logging
 
-from openai import OpenAI
 
 from flask import jsonify
 from datetime import datetime, timedelta
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-from flask import Flask, render_template, request, session, redirect, url_for, send_from_directory
+from utils.llm_cache import response_cache
+# Every LLM call goes through the shared gateway (interactive lane by default)
+from utils.llm_gateway import gateway as client, StreamInterrupted
+from flask import Flask, render_template, request, session, redirect, url_for, send_from_directory, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from sqlalchemy import update, select
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm import load_only, deferred, undefer_group, selectinload
+from flask_socketio import SocketIO, emit as socket_emit, join_room, leave_room
 from utils.llm_utils import (
     generate_structured_summary,
+    update_structured_summary,
     shipping_expert_review,
     chargeback_policies_expert_review,
-    final_adjudication
+    final_adjudication,
+    describe_evidence,
+    summarize_conversation
 )
+from utils.evidence_cache import EvidenceCache
+from utils.evidence import EvidenceFile
+from utils.evidence_pipeline import preprocess_evidence
+from utils.image_utils import normalize_image
+from utils.jobs import JobQueue
+from utils.ttl_cache import TTLCache
+from utils.db_utils import engine_options, configure_sqlite, instrument_queries, add_missing_columns
+from utils.claim_projection import (project_claim, project_structured_data, project_expert_feedback, project_adjudication, structured_field,
+                                   DISPUTE_CATEGORIES, ITEM_OR_SERVICE)
+from utils.metrics import registry, span, traced, trace_id_for, get_trace, SPECULATIONS, VALIDATIONS, POLICY_REVIEWS
+from utils.context_window import build_context_window
+from utils.pubsub import socketio_queue_options
+from utils.streaming import JsonFieldStream, partial_json_field
+from utils.answer_matching import match_option
+from utils.policy_rules import precheck_policies
 from email.mime.text import MIMEText
 import threading
+import functools
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import base64
+import hashlib
 import json
 from datetime import datetime
 import mimetypes
 
 from enum import Enum
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
 app.config['SECRET_KEY'] = 'your-secret-key'  # Replace with your actual secret key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///claims.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///claims.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.getenv('DATABASE_POOL_SIZE', 10)),
+    max_overflow=int(os.getenv('DATABASE_MAX_OVERFLOW', 20)),
+    busy_timeout_ms=int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+)
 app.config['UPLOAD_FOLDER'] = 'uploaded_files'
+app.config['PARTIAL_UPLOAD_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], '.partial')
+app.config['MAX_UPLOAD_BYTES'] = int(os.getenv('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))
+app.config['EVIDENCE_CACHE_FOLDER'] = os.getenv('EVIDENCE_CACHE_FOLDER', 'evidence_cache')
+app.config['EVIDENCE_CACHE_MAX_BYTES'] = int(os.getenv('EVIDENCE_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+app.config['EVIDENCE_WORKERS'] = int(os.getenv('EVIDENCE_WORKERS', 2))  # Processes parsing PDFs and images
+app.config['MAX_IMAGE_DIMENSION'] = int(os.getenv('MAX_IMAGE_DIMENSION', 1568))  # Longest side of images sent to the vision model
+app.config['IMAGE_QUALITY'] = int(os.getenv('IMAGE_QUALITY', 85))  # Re-encoding quality of normalized images
+app.config['IMAGE_CACHE_FOLDER'] = os.getenv('IMAGE_CACHE_FOLDER', 'image_cache')  # Normalized images, keyed by content hash
+app.config['LLM_MAX_CONCURRENCY'] = int(os.getenv('LLM_MAX_CONCURRENCY', 4))  # Background jobs calling the LLM at once
+app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 300))  # Seconds a user_uuid -> user id lookup is reused
+app.config['CONTEXT_RECENT_MESSAGES'] = int(os.getenv('CONTEXT_RECENT_MESSAGES', 12))  # Messages kept verbatim; older ones are folded into the rolling summary in batches
+app.config['CONTEXT_TOKEN_BUDGET'] = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))  # Approximate token budget for the conversation in a prompt
+app.config['BATCH_REDUNDANCY_CHECKS'] = os.getenv('BATCH_REDUNDANCY_CHECKS', 'true').lower() == 'true'  # One LLM call for all remaining questions
+app.config['SPECULATIVE_PREFETCH'] = os.getenv('SPECULATIVE_PREFETCH', 'true').lower() == 'true'  # Evaluate the next questions while the answer is validated
+app.config['LOCAL_OPTION_MATCHING'] = os.getenv('LOCAL_OPTION_MATCHING', 'true').lower() == 'true'  # Validate answers to questions with options without the LLM when they clearly match one
+app.config['POLICY_PRECHECK'] = os.getenv('POLICY_PRECHECK', 'true').lower() == 'true'  # Apply the date-based chargeback policies without the LLM when they decide the claim
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE')  # Broker URL shared by every worker (redis://, amqp://) or local:// for the in-process stand-in
+app.config['STREAM_REPLIES'] = os.getenv('STREAM_REPLIES', 'true').lower() == 'true'  # Stream clarifications and adjudications as message_delta events
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
+if not os.path.exists(app.config['PARTIAL_UPLOAD_FOLDER']):
+    os.makedirs(app.config['PARTIAL_UPLOAD_FOLDER'])
+logging.basicConfig()
+logging.getLogger('easyclaim.trace').setLevel(os.getenv('TRACE_LOG_LEVEL', 'INFO'))  # INFO logs spans slower than a second, DEBUG logs all of them
 db = SQLAlchemy(app)
-socketio = SocketIO(app, manage_session=False, max_http_buffer_size=100000000, cors_allowed_origins='*')
+evidence_cache = EvidenceCache(app.config['EVIDENCE_CACHE_FOLDER'], app.config['EVIDENCE_CACHE_MAX_BYTES'])
+# With a message queue, emits to a claim's room reach its clients whichever
+# worker they are connected to
+socketio = SocketIO(app, manage_session=False, max_http_buffer_size=100000000, cors_allowed_origins='*',
+                    **socketio_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
 
 suhas_mode = False
 
+def claim_room(claim_id):
+    return f'claim_{claim_id}'
+
+def emit(event, *args, **kwargs):
+    # Reply to the client of the current socket event, once its unit of work has committed
+    def send():
+        with span(f'emit.{event}'):
+            socket_emit(event, *args, **kwargs)
+    after_commit(send)
+
+def emit_to_claim(claim_id, event, data, immediate=False):
+    # Send to every client in the claim's room, on any worker; works outside
+    # socket events too. Inside one it waits for the commit unless immediate.
+    def send():
+        with span(f'emit.{event}'):
+            socketio.emit(event, data, room=claim_room(claim_id))
+    if immediate:
+        send()
+    else:
+        after_commit(send)
+
+def stream_to_claim(claim_id, field, when=None, prefix=None):
+    # Returns the stream ID and a JsonFieldStream whose feed pushes the text of
+    # one field of a streamed JSON reply to the claim's room as message_delta
+    # events. The final 'message' event carrying the same stream_id replaces it.
+    stream_id = str(uuid.uuid4())
+    stream = JsonFieldStream(field, lambda delta: emit_to_claim(claim_id, 'message_delta', {'stream_id': stream_id, 'delta': delta}, immediate=True), when, prefix)
+    return stream_id, stream
+
+def report_job_progress(job):
+    emit_to_claim(job.claim_id, 'job_progress', {'job_id': job.id, 'job': job.name, 'status': job.status})
+
+# Summaries, expert reviews and adjudication run here instead of in the socket handlers
+jobs = JobQueue(max_workers=app.config['LLM_MAX_CONCURRENCY'], on_event=report_job_progress, context=app.app_context)
+
+# CPU-bound evidence parsing (PyPDF2, image decoding) runs in separate processes
+evidence_pool = None
+
+def get_evidence_pool():
+    global evidence_pool
+    if evidence_pool is None:
+        evidence_pool = ProcessPoolExecutor(max_workers=app.config['EVIDENCE_WORKERS'])
+    return evidence_pool
+
+# Speculative LLM calls made while the user's answer is being validated
+speculation_pool = ThreadPoolExecutor(max_workers=app.config['LLM_MAX_CONCURRENCY'])
+
 # Define Claim States
 class ClaimState(Enum):
     START = 'START'
@@ -59,29 +167,50 @@ class User(db.Model):
     claims = db.relationship('Claim', backref='user', lazy=True)
 
 class Claim(db.Model):
+    # The large text and JSON columns are in the 'details' group: they are left
+    # out of every claim query unless it asks for CLAIM_DETAILS, and the first
+    # access to any of them loads the whole group in one query
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    raw_text = db.Column(db.Text)
-    structured_data = db.Column(db.Text)
-    status = db.Column(db.String(50))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    raw_text = deferred(db.Column(db.Text), group='details')
+    structured_data = deferred(db.Column(db.Text), group='details')
+    status = db.Column(db.String(50), index=True)
     state = db.Column(db.String(50), default=ClaimState.START.value)
-    additional_info = db.Column(db.Text)
+    additional_info = deferred(db.Column(db.Text), group='details')
     transaction_description = db.Column(db.Text)
     transaction_id = db.Column(db.String(50))
     amount = db.Column(db.String(50))
     merchant_email = db.Column(db.String(100))
     transaction_date = db.Column(db.String(50))
-    adjudication_result = db.Column(db.Text)
-    expert_feedback = db.Column(db.Text)
-    merchant_response = db.Column(db.Text)
+    adjudication_result = deferred(db.Column(db.Text), group='details')
+    expert_feedback = deferred(db.Column(db.Text), group='details')
+    merchant_response = deferred(db.Column(db.Text), group='details')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    messages = db.relationship('Message', backref='claim', lazy=True)
+    messages = db.relationship('Message', backref='claim', lazy=True, order_by='Message.id')
     files = db.relationship('File', backref='claim', lazy=True)
     chat_locked = db.Column(db.Boolean, default=False)
     current_question = db.Column(db.String(50))  # To track the current question
-    claim_summary = db.Column(db.Text)
-    answers = db.Column(db.Text)  # New field to store answers as JSON
+    claim_summary = deferred(db.Column(db.Text), group='details')
+    answers = deferred(db.Column(db.Text), group='details')  # New field to store answers as JSON
     question_index = db.Column(db.Integer)  # New field to store current question index
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped by update_claim for optimistic locking
+    summary_state = deferred(db.Column(db.Text), group='details')  # Answers, files and additional info already merged into structured_data
+    context_summary = deferred(db.Column(db.Text), group='details')  # Rolling summary of the messages older than the prompt context window
+    context_summary_upto = db.Column(db.Integer)  # Last message ID folded into context_summary
+    # Projections of the JSON columns above, rewritten by apply_projection whenever those are written
+    dispute_category = db.Column(db.String(50), index=True)
+    item_or_service = db.Column(db.String(20), index=True)
+    tracking_number = db.Column(db.String(100), index=True)
+    expert_action = db.Column(db.String(50), index=True)  # Action from the chargeback policy review
+    decision = db.Column(db.String(20), index=True)  # Final adjudication decision
+
+    # Newest-first keyset pagination of /claims
+    __table_args__ = (db.Index('ix_claim_created_at_id', 'created_at', 'id'),)
+
+# Loader options: a claim's details for the paths that read them, and just its
+# header for list views, ownership checks and state checks
+CLAIM_DETAILS = undefer_group('details')
+CLAIM_HEADER = load_only(Claim.id, Claim.user_id, Claim.status, Claim.state, Claim.chat_locked, Claim.created_at)
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -90,6 +219,8 @@ class Message(db.Model):
     content = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_message_claim_id_timestamp', 'claim_id', 'timestamp'),)
+
 class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     claim_id = db.Column(db.Integer, db.ForeignKey('claim.id'))
@@ -97,64 +228,201 @@ class File(db.Model):
     filepath = db.Column(db.String(500))
     filetype = db.Column(db.String(50))
     description = db.Column(db.Text)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the file contents, key into the evidence cache
+
+class Upload(db.Model):
+    id = db.Column(db.String(36), primary_key=True)  # Upload ID handed to the client
+    claim_id = db.Column(db.Integer, db.ForeignKey('claim.id'))
+    filename = db.Column(db.String(200))
+    filepath = db.Column(db.String(500))  # Preallocated partial file the chunks are written into
+    size = db.Column(db.Integer)
+    chunk_size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    chunks = db.relationship('UploadChunk', backref='upload', lazy=True)
+
+class UploadChunk(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(36), db.ForeignKey('upload.id'), index=True)
+    offset = db.Column(db.Integer)
 
 with app.app_context():
+    configure_sqlite(db.engine, int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)))
+    instrument_queries(db.engine)
     db.create_all()
+    # create_all never alters existing tables; bring a database made by an
+    # older version up to the current columns and indexes
+    for table in db.metadata.sorted_tables:
+        added = add_missing_columns(db.engine, table)
+        if added:
+            print(f"Added columns to {table.name}: {', '.join(added)}")
+
+# Unit of work: a socket event stages its changes in memory (autoflush is off,
+# so no write lock is held while the LLM is called) and writes them in one
+# transaction when the event ends. The emits and jobs it produces are held back
+# until that commit has succeeded. Outside a socket event (jobs, HTTP routes)
+# commit() and after_commit() act immediately.
+def in_unit_of_work():
+    return has_app_context() and g.get('after_commit') is not None
+
+def commit():
+    if not in_unit_of_work():
+        db.session.commit()
+
+def after_commit(fn, *args, **kwargs):
+    if in_unit_of_work():
+        g.after_commit.append(functools.partial(fn, *args, **kwargs))
+    else:
+        fn(*args, **kwargs)
+
+def unit_of_work(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.after_commit = []
+        g.staged_answers = {}
+        try:
+            with db.session.no_autoflush:
+                result = fn(*args, **kwargs)
+            with span('db_commit'):
+                write_staged_answers(g.staged_answers)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            actions, g.after_commit = g.after_commit, None
+            g.staged_answers = None
+        for action in actions:
+            action()
+        return result
+    return wrapper
+
+def submit_job(claim_id, name, fn, *args, **kwargs):
+    # Jobs read what the event wrote, so they start after its commit
+    after_commit(jobs.submit, claim_id, name, fn, *args, **kwargs)
+
+def add_message(claim, sender, content):
+    # Appended to the loaded conversation so later reads in the same event see it
+    message = Message(sender=sender, content=content)
+    claim.messages.append(message)
+    return message
+
+def apply_projection(claim, values):
+    # Keep the projected columns in step with the JSON they were read from
+    for column, value in values.items():
+        setattr(claim, column, value)
+
+def update_claim(claim, **changes):
+    # Optimistic write: only applied if no other update_claim has bumped the
+    # claim's version since it was loaded. Returns False on a conflict, after
+    # which the changed fields are reloaded on next access.
+    result = db.session.execute(
+        update(Claim)
+        .where(Claim.id == claim.id, Claim.version == claim.version)
+        .values(version=Claim.version + 1, **changes)
+        .execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        db.session.expire(claim, list(changes) + ['version'])
+        commit()
+        return False
+    # Bring the loaded claim up to date without reading it back
+    for name, value in changes.items():
+        set_committed_value(claim, name, value)
+    set_committed_value(claim, 'version', claim.version + 1)
+    commit()
+    return True
+
+def save_answer(claim, field_id, answer):
+    # Answers are read-modify-write on one JSON column, so retry against the
+    # latest answers if another event saved one at the same time. Inside a unit
+    # of work the answer is only staged and written when the event commits.
+    if in_unit_of_work():
+        answers = json.loads(claim.answers or '{}')
+        answers[field_id] = answer
+        set_committed_value(claim, 'answers', json.dumps(answers))
+        g.staged_answers.setdefault(claim, {})[field_id] = answer
+        return answers
+    for _ in range(3):
+        answers = json.loads(claim.answers or '{}')
+        answers[field_id] = answer
+        if update_claim(claim, answers=json.dumps(answers)):
+            return answers
+    print(f"Could not save answer to {field_id} for claim {claim.id}")
+    return json.loads(claim.answers or '{}')
+
+def write_staged_answers(staged_answers):
+    # Merge each claim's staged answers into its stored answers with the same
+    # version check as update_claim, retrying if another event saved some first
+    for claim, staged in staged_answers.items():
+        for _ in range(3):
+            stored = db.session.execute(select(Claim.answers, Claim.version).where(Claim.id == claim.id)).one()
+            answers = json.loads(stored.answers or '{}')
+            answers.update(staged)
+            result = db.session.execute(
+                update(Claim)
+                .where(Claim.id == claim.id, Claim.version == stored.version)
+                .values(answers=json.dumps(answers), version=stored.version + 1)
+                .execution_options(synchronize_session=False))
+            if result.rowcount == 1:
+                set_committed_value(claim, 'answers', json.dumps(answers))
+                set_committed_value(claim, 'version', stored.version + 1)
+                break
+        else:
+            print(f"Could not save answers {list(staged)} for claim {claim.id}")
 
 # Define the required fields for the claim
 required_fields = [
-    {'id': 'issue_description', 'question': 'Please describe the issue you are experiencing. (i.e. Item not received, Item damaged, Unauthorized transaction, Other)', 'field': 'issue_description', 'options': ['Item not received', 'Item damaged', 'Unauthorized transaction', 'Other']},
-    {'id': 'item_or_service', 'question': 'Is the dispute about an item or a service?', 'field': 'item_or_service', 'options': ['Item', 'Service']},
+    {'id': 'issue_description', 'question': 'Please describe the issue you are experiencing. (i.e. Item not received, Item damaged, Unauthorized transaction, Other)', 'field': 'issue_description', 'options': DISPUTE_CATEGORIES},
+    {'id': 'item_or_service', 'question': 'Is the dispute about an item or a service?', 'field': 'item_or_service', 'options': ITEM_OR_SERVICE},
     {'id': 'item_name', 'question': 'Please provide the name of the item or service.', 'field': 'item_name'},
     {'id': 'have_contacted_seller', 'question': 'Have you contacted the merchant about this issue?', 'field': 'have_contacted_seller', 'options': ['Yes', 'No']},
     {'id': 'shipping_info', 'question': 'Please provide any shipping information (tracking number or shipping link) if available.', 'field': 'shipping_info', 'optional': True, 'condition': 'The item is not a service and the issue is that the item was not received.'},
 ]
 
+# user_uuid -> User.id, so requests don't hit the database just to identify the user
+user_id_cache = TTLCache(max_size=10000, ttl=app.config['IDENTITY_CACHE_TTL'])
+
+# Static and read-only endpoints never need the user
+ANONYMOUS_ENDPOINTS = {'static', 'uploaded_file', 'get_messages', 'view_claim', 'merchant_view', 'llm_cache_stats', 'metrics', 'claim_trace', 'validation_stats', 'list_claims', 'policy_stats'}
+
 @app.before_request
 def load_user():
+    if request.endpoint in ANONYMOUS_ENDPOINTS:
+        return
+    if not session.get('user_uuid'):
+        # No user UUID in session; the user row is only created once a claim is started
+        session['user_uuid'] = str(uuid.uuid4())
+
+def get_current_user_id(create=False):
     user_uuid = session.get('user_uuid')
     if not user_uuid:
-        # No user UUID in session, create a new user
-        user_uuid = str(uuid.uuid4())
-        session['user_uuid'] = user_uuid
-        # Create a new user in the database
+        return None
+
+    user_id = user_id_cache.get(user_uuid)
+    if user_id is not None:
+        return user_id
+
+    user = User.query.filter_by(user_uuid=user_uuid).first()
+    if not user:
+        if not create:
+            return None
         user = User(user_uuid=user_uuid)
         db.session.add(user)
-        db.session.commit()
-    else:
-        # User UUID exists, retrieve the user
-        user = User.query.filter_by(user_uuid=user_uuid).with_for_update().first()
-        if not user:
-            # User not found in database, create a new user
-            user = User(user_uuid=user_uuid)
-            db.session.add(user)
-            db.session.commit()
+        commit()
+    user_id_cache.set(user_uuid, user.id)
+    return user.id
 
 @app.route('/login/<user_uuid>')
 def login(user_uuid):
-    # Check if the user exists
-    user = User.query.filter_by(user_uuid=user_uuid).with_for_update().first()
-    if user:
-        # Set the user_uuid in the session
-        session['user_uuid'] = user_uuid
-        return redirect(url_for('index'))
-    else:
-        # User not found, create a new user
-        user = User(user_uuid=user_uuid)
-        db.session.add(user)
-        db.session.commit()
-        session['user_uuid'] = user_uuid
-        return redirect(url_for('index'))
+    # Set the user_uuid in the session; the user is created with their first claim
+    session['user_uuid'] = user_uuid
+    return redirect(url_for('index'))
 
 @app.route('/')
 def index():
-    user_uuid = session.get('user_uuid')
-    user = User.query.filter_by(user_uuid=user_uuid).with_for_update().first()
-    if not user:
-        return redirect(url_for('load_user'))
+    user_id = get_current_user_id()
 
     # Retrieve the user's claims
-    claims = Claim.query.filter_by(user_id=user.id).all()
+    claims = Claim.query.options(CLAIM_HEADER).filter_by(user_id=user_id).all() if user_id else []
 
     # For testing purposes, we're using hardcoded transaction details
     # In a real application, these would be provided based on user selection
@@ -178,15 +446,12 @@ def start_new_claim():
     merchant_email = request.args.get('merchant_email')
     amount = abs(float(request.args.get('amount')))
     # Create a new claim and redirect to its chat window
-    user_uuid = session.get('user_uuid')
-    user = User.query.filter_by(user_uuid=user_uuid).with_for_update().first()
-    if not user:
-        return redirect(url_for('load_user'))
+    user_id = get_current_user_id(create=True)
 
     # Create a new claim
-    claim = Claim(user_id=user.id, status='In Progress', state=ClaimState.START.value, transaction_id=transaction_id, amount=amount, merchant_email=merchant_email, transaction_date=transaction_date, transaction_description=transaction_description)
+    claim = Claim(user_id=user_id, status='In Progress', state=ClaimState.START.value, transaction_id=transaction_id, amount=amount, merchant_email=merchant_email, transaction_date=transaction_date, transaction_description=transaction_description)
     db.session.add(claim)
-    db.session.commit()
+    commit()
     
     session['transaction_details'] = {
         'transaction_name': 'Purchase at ABC Store',
@@ -205,13 +470,8 @@ def start_new_claim():
 
 @app.route('/claim/<int:claim_id>')
 def view_claim(claim_id):
-    user_uuid = session.get('user_uuid')
-    user = User.query.filter_by(user_uuid=user_uuid).with_for_update().first()
-    if not user:
-        return redirect(url_for('load_user'))
-
     # Get the claim
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_HEADER).filter_by(id=claim_id).first()
     
     if not claim:
         return 'Claim not found or you do not have access to it.', 404
@@ -221,20 +481,121 @@ def view_claim(claim_id):
 
     return render_template('view_claim.html', claim=claim, chat_locked=chat_locked)
 
+CLAIM_PAGE_SIZE = 50
+CLAIM_PAGE_MAX = 200
+CLAIM_LIST_COLUMNS = (Claim.id, Claim.status, Claim.state, Claim.dispute_category, Claim.item_or_service, Claim.expert_action,
+                      Claim.decision, Claim.merchant_email, Claim.amount,
+                      Claim.transaction_id, Claim.transaction_description, Claim.transaction_date, Claim.created_at)
+
+def parse_date_arg(name, end_of_day=False):
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    # A bare date as the upper bound covers the whole day
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1) - timedelta(microseconds=1)
+    return parsed
+
+def claim_cursor(row):
+    # The (created_at, id) a page ended on; the next page starts right after it
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+def parse_claim_cursor(value):
+    created_at, _, claim_id = value.rpartition('_')
+    return datetime.fromisoformat(created_at), int(claim_id)
+
+@app.route('/claims', methods=['GET'])
+def list_claims():
+    # Claims for the review dashboard, newest first. Filters: status, state and
+    # dispute_category, item_or_service, expert_action and decision (comma
+    # separated for several), merchant_email, from/to
+    # (ISO dates on created_at) and q (search in the transaction description).
+    # Keyset pagination: ?after=<next_cursor of the previous page>&limit=N
+    query = db.session.query(*CLAIM_LIST_COLUMNS)
+    for name, column in (('status', Claim.status), ('state', Claim.state), ('dispute_category', Claim.dispute_category),
+                         ('item_or_service', Claim.item_or_service), ('expert_action', Claim.expert_action), ('decision', Claim.decision)):
+        values = [value for value in request.args.get(name, '').split(',') if value]
+        if values:
+            query = query.filter(column.in_(values))
+    if request.args.get('merchant_email'):
+        query = query.filter(Claim.merchant_email == request.args['merchant_email'])
+    try:
+        created_from = parse_date_arg('from')
+        created_to = parse_date_arg('to', end_of_day=True)
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates.'}), 400
+    if created_from:
+        query = query.filter(Claim.created_at >= created_from)
+    if created_to:
+        query = query.filter(Claim.created_at <= created_to)
+    search = request.args.get('q', '').strip()
+    if search:
+        query = query.filter(Claim.transaction_description.ilike(f"%{search}%"))
+
+    after = request.args.get('after')
+    limit = min(max(request.args.get('limit', CLAIM_PAGE_SIZE, type=int), 1), CLAIM_PAGE_MAX)
+    if after:
+        # The cursor carries its own position, so it stays valid if that claim is deleted
+        try:
+            cursor_created_at, cursor_id = parse_claim_cursor(after)
+        except ValueError:
+            return jsonify({'error': 'after must be a next_cursor from a previous page.'}), 400
+        query = query.filter(db.or_(
+            Claim.created_at < cursor_created_at,
+            db.and_(Claim.created_at == cursor_created_at, Claim.id < cursor_id)
+        ))
+    rows = query.order_by(Claim.created_at.desc(), Claim.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    claims = [{
+        'id': row.id,
+        'status': row.status,
+        'state': row.state,
+        'dispute_category': row.dispute_category,
+        'item_or_service': row.item_or_service,
+        'expert_action': row.expert_action,
+        'decision': row.decision,
+        'merchant_email': row.merchant_email,
+        'amount': row.amount,
+        'transaction_id': row.transaction_id,
+        'transaction_description': row.transaction_description,
+        'transaction_date': row.transaction_date,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    } for row in rows]
+    return jsonify({'claims': claims, 'next_cursor': claim_cursor(rows[-1]) if rows else after, 'has_more': has_more})
+
+MESSAGE_PAGE_SIZE = 100
+MESSAGE_PAGE_MAX = 500
+
 @app.route('/get_messages/<int:claim_id>', methods=['GET'])
 def get_messages(claim_id):
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
-    print(claim_id)
-    print(claim.messages)
+    # Cursor pagination over (timestamp, id): ?after=<message id>&limit=N returns
+    # the messages following that one, so clients that pass the last message they
+    # have seen only receive what is new
+    claim = Claim.query.options(load_only(Claim.id, Claim.claim_summary)).filter_by(id=claim_id).first()
     if not claim:
         return jsonify({'error': 'Unauthorized access or claim not found.'}), 403
 
-    messages = Message.query.filter_by(claim_id=claim_id).order_by(Message.timestamp).all()
-    messages_list = [{'sender': msg.sender, 'content': msg.content, 'timestamp': msg.timestamp.isoformat()} for msg in messages]
-    # check if message was created in the last 5 seconds, if so, exclude
-    #if messages_list and datetime.fromisoformat(messages_list[-1]['timestamp']) > datetime.now() - timedelta(seconds=5):
-        #messages_list = []
-    return jsonify({'messages': messages_list, 'claim_summary': claim.claim_summary})
+    after = request.args.get('after', type=int)
+    limit = min(max(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), 1), MESSAGE_PAGE_MAX)
+
+    query = Message.query.filter_by(claim_id=claim_id)
+    if after:
+        cursor = Message.query.filter_by(id=after, claim_id=claim_id).first()
+        if cursor:
+            query = query.filter(db.or_(
+                Message.timestamp > cursor.timestamp,
+                db.and_(Message.timestamp == cursor.timestamp, Message.id > cursor.id)
+            ))
+    messages = query.order_by(Message.timestamp, Message.id).limit(limit + 1).all()
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    messages_list = [{'id': msg.id, 'sender': msg.sender, 'content': msg.content, 'timestamp': msg.timestamp.isoformat()} for msg in messages]
+    next_cursor = messages[-1].id if messages else after
+    return jsonify({'messages': messages_list, 'claim_summary': claim.claim_summary, 'next_cursor': next_cursor, 'has_more': has_more})
 
 @socketio.on('get_all_messages')
 def get_all_messages():
@@ -244,23 +605,24 @@ def get_all_messages():
     
     user_uuid = session.get('user_uuid')
     
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_HEADER, selectinload(Claim.messages)).filter_by(id=claim_id).first()
     for message in claim.messages:
         emit('message', {'text': message.content})
 
 @socketio.on('connect')
-def handle_connect():
+@traced('event.connect', lambda auth=None: request.args.get('claimId'))
+@unit_of_work
+def handle_connect(auth=None):
     session_id = request.sid
     # Get the current claim ID from the session
     # claim_id = session.get('current_claim_id')
-    print('----')
-        # No claim in session; do nothing
     claim_id = request.args.get('claimId')
 
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_DETAILS, selectinload(Claim.messages)).filter_by(id=claim_id).first()
     if not claim:
         # Claim not found; do nothing
         return
+    join_room(claim_room(claim.id))
 
     # Get transaction details from the client (if needed)
     transaction_details = {
@@ -274,22 +636,7 @@ def handle_connect():
     # If the claim is already completed, do not ask questions
 
 
-    files = []
-    file_records = File.query.filter_by(claim_id=claim.id).all()
-    for file_record in file_records:
-        with open(file_record.filepath, 'rb') as f:
-            file_data = f.read()
-            files.append({
-                'name': file_record.filename,
-                'data': file_data,
-                'type': file_record.filetype,
-                'filepath': file_record.filepath  # Include filepath for PDF processing
-            })
-            
-    structured_data = generate_structured_summary(claim, claim.answers, files, transaction_details, claim.additional_info)
-    claim.structured_data = json.dumps(structured_data)
-    db.session.commit()
-    emit('update_claim_summary', {'claim_summary': structured_data})
+    submit_job(claim.id, 'summary', summary_job, claim.id, transaction_details)
     
     if claim.state == ClaimState.COMPLETED.value:
         emit("message", {"text": "This claim has already been submitted and is awaiting further action."})
@@ -297,17 +644,13 @@ def handle_connect():
     
  
     # If there is a current question, resume from there
-    print(claim)
-    print("Trying to initiate convo")
     if claim.current_question:
         ask_next_question(claim)
     else:
         # Start the conversation
-        print('Starting Conversation')
         start_conversation(claim, transaction_details)
 
 def start_conversation(claim, transaction_details):
-    print(claim.id)
     # Only send initial messages if this is a new claim (no messages exist)
     if not claim.messages:
         transaction_info = f"""
@@ -325,45 +668,72 @@ You are disputing the following transaction:
 
         # Save assistant messages
         #message1 = Message(claim_id=claim.id, sender='assistant', content=transaction_info)
-        message2 = Message(claim_id=claim.id, sender='assistant', content="Hi Suhas! Let's try to understand your dispute a bit better.")
+        message2 = add_message(claim, 'assistant', "Hi Suhas! Let's try to understand your dispute a bit better.")
         #db.session.add(message1)
-        db.session.add(message2)
-        db.session.commit()
+        commit()
 
     # Initialize answers
 
-    print(claim.answers is None)
     if not claim.answers:
         claim.answers = json.dumps({})
-        db.session.commit()
-        print("comitting")
+        commit()
 
     # Start asking questions
     if claim.question_index is None:
         claim.question_index = 0
-        db.session.commit()
+        commit()
 
     ask_next_question(claim)
 
-def is_question_redundant(claim, field):
-    # Check if the question is not relevant based on previous answers
-    answers = json.loads(claim.answers)
-                
-    # Check if the question has already been answered in previous responses
-    # Fetch previous messages
-    messages_db = Message.query.filter_by(claim_id=claim.id).order_by(Message.timestamp).all()
-    # Get the question text
-    question = field['question']
-    # Build the conversation history
+def build_conversation_context(claim):
+    # Built once per turn and shared by every LLM call made during it: the
+    # rolling summary of older messages plus the most recent messages that fit
+    # the token budget. Every message not yet folded into the summary is a
+    # candidate, since compress_conversation_job only folds them in batches.
+    # Uses the claim's loaded messages, so messages added in this event but not
+    # yet written are included.
+    messages_db = [msg for msg in claim.messages if msg.id is None or not claim.context_summary_upto or msg.id > claim.context_summary_upto]
+
     conversation = []
     for msg in messages_db:
         role = 'assistant' if msg.sender == 'assistant' else 'user'
         conversation.append({'role': role, 'content': msg.content})
+    return build_context_window(conversation, claim.context_summary or '', app.config['CONTEXT_TOKEN_BUDGET'])
+
+@traced('job.context_summary', lambda claim_id: claim_id)
+def compress_conversation_job(claim_id):
+    # Fold messages that have fallen out of the recent window into the rolling
+    # summary, a few at a time so it doesn't cost an LLM call every turn
+    claim = Claim.query.options(CLAIM_DETAILS).filter_by(id=claim_id).first()
+    if not claim:
+        return
+    query = Message.query.filter_by(claim_id=claim.id)
+    if claim.context_summary_upto:
+        query = query.filter(Message.id > claim.context_summary_upto)
+    messages_db = query.order_by(Message.timestamp, Message.id).all()
+
+    older = messages_db[:-app.config['CONTEXT_RECENT_MESSAGES']]
+    if len(older) < app.config['CONTEXT_RECENT_MESSAGES'] // 2:
+        return
+
+    conversation = [{'role': 'assistant' if msg.sender == 'assistant' else 'user', 'content': msg.content} for msg in older]
+    context_summary = summarize_conversation(claim.context_summary, conversation)
+    if context_summary:
+        claim.context_summary = context_summary
+        claim.context_summary_upto = older[-1].id
+        commit()
+
+def is_question_redundant(claim, field, context=None):
+    # Check if the question has already been answered in previous responses
+    if context is None:
+        context = build_conversation_context(claim)
+    # Get the question text
+    question = field['question']
     # Add system prompt
     system_prompt = "You are an assistant helping to determine if the user's previous responses have already answered a specific question in a credit card chargeback process."
     messages = [{'role': 'system', 'content': system_prompt}]
     # Add the conversation history
-    messages.extend(conversation)
+    messages.extend(context)
     # Add the final assistant prompt
     assistant_prompt = f"Has the user already provided enough information to answer the following question: '{question}'? Respond with 'Yes' or 'No' in JSON format: {{\"answered\": \"Yes\" or \"No\"}}"
     
@@ -374,7 +744,7 @@ def is_question_redundant(claim, field):
         condition_messages.append({'role': 'assistant', 'content': condition_prompt})
         # evaluate if the condition is met
         try:
-            response = client.chat.completions.create(model="gpt-4o",
+            response = client.chat.completions.create(call="redundancy_condition", model="gpt-4o",
             messages=condition_messages,
             max_tokens=50,
             temperature=0.0,
@@ -391,7 +761,7 @@ def is_question_redundant(claim, field):
     messages.append({'role': 'assistant', 'content': assistant_prompt})
     # Call GPT-4 API
     try:
-        response = client.chat.completions.create(model="gpt-4o",
+        response = client.chat.completions.create(call="redundancy", model="gpt-4o",
         messages=messages,
         max_tokens=50,
         temperature=0.0,
@@ -401,12 +771,10 @@ def is_question_redundant(claim, field):
         answered = result.get('answered', 'No')
         if answered.lower() == 'yes':
             # Try to extract the answer
-            extracted_answer = extract_answer(claim, question)
+            extracted_answer = extract_answer(claim, question, context)
             if extracted_answer:
                 # Save the extracted answer
-                answers[field['id']] = extracted_answer
-                claim.answers = json.dumps(answers)
-                db.session.commit()
+                save_answer(claim, field['id'], extracted_answer)
             return True
         else:
             return False
@@ -414,22 +782,16 @@ def is_question_redundant(claim, field):
         print(f"Error in is_question_redundant: {e}")
         return False
 
-def extract_answer(claim, question_text):
-    # Fetch previous messages
-    messages_db = Message.query.filter_by(claim_id=claim.id).order_by(Message.timestamp).all()
-
-    # Build the conversation history
-    conversation = []
-    for msg in messages_db:
-        role = 'assistant' if msg.sender == 'assistant' else 'user'
-        conversation.append({'role': role, 'content': msg.content})
+def extract_answer(claim, question_text, context=None):
+    if context is None:
+        context = build_conversation_context(claim)
 
     # Add system prompt
     system_prompt = "You are an assistant helping to extract the user's answer to a specific question from the conversation history."
     messages = [{'role': 'system', 'content': system_prompt}]
 
     # Add the conversation history
-    messages.extend(conversation)
+    messages.extend(context)
 
     # Add the final assistant prompt
     assistant_prompt = f"Please extract the user's answer to the following question: '{question_text}'. Provide the answer in JSON format: {{\"answer\": \"User's answer here\"}}"
@@ -437,7 +799,7 @@ def extract_answer(claim, question_text):
 
     # Call GPT-4 API
     try:
-        response = client.chat.completions.create(model="gpt-4o",
+        response = client.chat.completions.create(call="extraction", model="gpt-4o",
         messages=messages,
         max_tokens=150,
         temperature=0.0,
@@ -450,21 +812,103 @@ def extract_answer(claim, question_text):
         print(f"Error in extract_answer: {e}")
         return None
 
-def ask_next_question(claim):
+def evaluate_remaining_fields(claim, fields, context=None):
+    # Decide for every remaining question at once whether its condition holds,
+    # whether it has already been answered and what the answer was
+    if context is None:
+        context = build_conversation_context(claim)
+
+    system_prompt = "You are an assistant helping to determine which questions in a credit card chargeback process have already been answered by the user's previous responses."
+    messages = [{'role': 'system', 'content': system_prompt}]
+    messages.extend(context)
+
+    questions = [{'id': field['id'], 'question': field['question'], 'condition': field.get('condition', '')} for field in fields]
+    assistant_prompt = f"""For each of the following questions, determine based on the previous messages:
+- "condition_met": whether the question's condition is true (true if the question has no condition)
+- "answered": whether the user has already provided enough information to answer the question
+- "answer": the user's answer to the question if it has been answered, otherwise an empty string
+
+Questions:
+{json.dumps(questions, indent=2)}
+
+Respond in JSON format: {{"fields": [{{"id": "question id", "condition_met": true, "answered": false, "answer": ""}}]}}"""
+    messages.append({'role': 'assistant', 'content': assistant_prompt})
+
+    try:
+        response = client.chat.completions.create(call="redundancy_batch", model="gpt-4o",
+        messages=messages,
+        max_tokens=100 + 150 * len(fields),
+        temperature=0.0,
+        response_format={ "type": "json_object" })
+        result = json.loads(response.choices[0].message.content.strip())
+    except Exception as e:
+        print(f"Error in evaluate_remaining_fields: {e}")
+        return {}
+
+    evaluations = {}
+    for item in result.get('fields', []):
+        if not isinstance(item, dict) or not item.get('id'):
+            continue
+        evaluations[item['id']] = {
+            'condition_met': item.get('condition_met', True) is not False,
+            'answered': item.get('answered') is True or str(item.get('answered', '')).lower() == 'yes',
+            'answer': item.get('answer', '')
+        }
+    return evaluations
+
+def apply_field_evaluation(claim, field, evaluation):
+    # Same outcome as is_question_redundant, from a batched evaluation
+    if not evaluation['condition_met']:
+        return True
+    if not evaluation['answered']:
+        return False
+    if evaluation['answer']:
+        save_answer(claim, field['id'], evaluation['answer'])
+    return True
+
+def remaining_fields_from(answers, question_index):
+    return [field for field in required_fields[question_index:] if field['id'] not in answers]
+
+def prefetch_remaining_fields(claim, answers, question_index, context):
+    # Start the batched evaluation of the questions after question_index in the
+    # background, so it runs while the current answer is still being validated.
+    # The claim is only read here; the evaluation itself touches no database state.
+    remaining_fields = remaining_fields_from(answers, question_index)
+    if not remaining_fields or not app.config['BATCH_REDUNDANCY_CHECKS']:
+        return None
+    return speculation_pool.submit(contextvars.copy_context().run, evaluate_remaining_fields, claim, remaining_fields, context)
+
+def ask_next_question(claim, context=None, evaluations=None):
+    # evaluations, if given, is an already finished batched evaluation of the
+    # remaining questions made against the same context
     answers = json.loads(claim.answers)
     question_index = claim.question_index or 0
 
+    remaining_fields = remaining_fields_from(answers, question_index)
+    if remaining_fields and context is None:
+        context = build_conversation_context(claim)
+
+    if evaluations is None:
+        evaluations = {}
+        if app.config['BATCH_REDUNDANCY_CHECKS'] and remaining_fields:
+            evaluations = evaluate_remaining_fields(claim, remaining_fields, context)
+
     # Find the next required field that hasn't been answered
     while question_index < len(required_fields):
         field = required_fields[question_index]
         field_id = field['id']
         if field_id not in answers:
-            # Check if the question is redundant
-            if is_question_redundant(claim, field):
+            # Check if the question is redundant, falling back to the per-field
+            # checks for anything the batched evaluation did not cover
+            if field_id in evaluations:
+                redundant = apply_field_evaluation(claim, field, evaluations[field_id])
+            else:
+                redundant = is_question_redundant(claim, field, context)
+            if redundant:
                 # The question is redundant; skip it
                 question_index += 1
                 claim.question_index = question_index
-                db.session.commit()
+                commit()
                 continue  # Proceed to the next question
             else:
                 # Ask this question
@@ -475,14 +919,13 @@ def ask_next_question(claim):
                 emit('message', {'text': field['question']})
 
                 # Save assistant message
-                message = Message(claim_id=claim.id, sender='assistant', content=field['question'])
-                db.session.add(message)
-                db.session.commit()
+                message = add_message(claim, 'assistant', field['question'])
+                commit()
 
                 # Update the claim's current question and question index
                 claim.current_question = field_id
                 claim.question_index = question_index
-                db.session.commit()
+                commit()
                 return
         else:
             question_index += 1
@@ -490,18 +933,18 @@ def ask_next_question(claim):
     # All required fields have been answered
     # Proceed to evidence upload
     claim.current_question = 'evidence_available'
-    db.session.commit()
+    commit()
     emit('message', {'text': 'Please upload any evidence files that support your claim. If there is no relevant evidence or when you are done uploading, type "Done".'})
 
 
 @socketio.on('user_response')
+@traced('event.user_response', lambda data: data.get('claim_id'))
+@unit_of_work
 def handle_user_response(data):
     session_id = request.sid
-    user_uuid = session.get('user_uuid')
-    user = User.query.filter_by(user_uuid=user_uuid).with_for_update().first()
     claim_id = data.get('claim_id')
 
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_DETAILS, selectinload(Claim.messages)).filter_by(id=claim_id).first()
     if not claim:
         return
 
@@ -517,26 +960,19 @@ def handle_user_response(data):
     if claim.state == ClaimState.ADDITIONAL_INFO.value:
         emit('message', {'text': 'Thank you for providing additional information. We will review the information and get back to you.'})
         # Save message to database
-        message = Message(claim_id=claim.id, sender='user', content=user_response)
+        message = add_message(claim, 'user', user_response)
         claim.additional_info = user_response
-        db.session.add(message)
-        db.session.commit()
+        commit()
         create_claim(claim_id)
         return
 
     # Save message to database
-    message = Message(claim_id=claim.id, sender='user', content=user_response)
-    db.session.add(message)
-    db.session.commit()
+    message = add_message(claim, 'user', user_response)
+    commit()
     
     
-    # Load existing answers
-    answers = json.loads(claim.answers)
-
     # Save the user's response
-    answers[current_question] = user_response
-    claim.answers = json.dumps(answers)
-    db.session.commit()
+    save_answer(claim, current_question, user_response)
 
     
     if claim.question_index is None:
@@ -551,95 +987,263 @@ def handle_user_response(data):
             return
     
     field = required_fields[claim.question_index]
-    validation_result = validate_response_with_gpt4(claim.id, field['question'], user_response)
+    context = build_conversation_context(claim)
+
+    # Evaluate the following questions while this answer is validated; the
+    # result is thrown away if the answer needs clarification
+    prefetch = None
+    if app.config['SPECULATIVE_PREFETCH']:
+        prefetch = prefetch_remaining_fields(claim, json.loads(claim.answers or '{}'), claim.question_index + 1, context)
+
+    # Answers that clearly pick one of the question's options are valid without
+    # asking the LLM; anything else, including ambiguous matches, goes to it
+    if app.config['LOCAL_OPTION_MATCHING'] and field.get('options') and match_option(user_response, field['options']):
+        validation_result = {'valid': True, 'clarification': '', 'stream_id': None}
+        VALIDATIONS.inc(path='local')
+    else:
+        # Optional questions never ask for clarification, so there is nothing to stream
+        stream = app.config['STREAM_REPLIES'] and not field.get('optional', False)
+        validation_result = validate_response_with_gpt4(claim.id, field['question'], user_response, context, stream)
+        VALIDATIONS.inc(path='llm')
 
     if validation_result['valid'] or field.get('optional', False):
+        evaluations = None
+        if prefetch:
+            try:
+                evaluations = prefetch.result()
+                SPECULATIONS.inc(outcome='used')
+            except Exception as e:
+                print(f"Error in speculative evaluation for claim {claim.id}: {e}")
         # Move to the next question
         claim.question_index += 1
         claim.current_question = None
-        db.session.commit()
-        ask_next_question(claim)
+        commit()
+        ask_next_question(claim, context, evaluations)
     else:
+        if prefetch:
+            prefetch.cancel()
+            SPECULATIONS.inc(outcome='discarded')
         # Ask for clarification
         clarification = validation_result['clarification']
-        emit('message', {'text': clarification})
 
         # Save assistant's message
-        assistant_message = Message(claim_id=claim.id, sender='assistant', content=clarification)
-        db.session.add(assistant_message)
-        db.session.commit()
+        assistant_message = add_message(claim, 'assistant', clarification)
+        commit()
+        emit_to_claim(claim.id, 'message', {'text': clarification, 'stream_id': validation_result.get('stream_id')})
 
-    answers = json.loads(claim.answers)
     transaction_details = session.get('transaction_details', {})
+    submit_job(claim.id, 'summary', summary_job, claim.id, transaction_details)
+    submit_job(claim.id, 'context_summary', compress_conversation_job, claim.id)
+
+@traced('job.summary', lambda claim_id, transaction_details: claim_id)
+def summary_job(claim_id, transaction_details):
+    claim = Claim.query.options(CLAIM_DETAILS, selectinload(Claim.files)).filter_by(id=claim_id).first()
+    if not claim:
+        return
+    answers = json.loads(claim.answers or '{}')
 
     # Get files associated with the claim
+    files = load_claim_files(claim)
+
+    structured_data = refresh_structured_summary(claim, answers, files, transaction_details)
+    if structured_data is not None:
+        emit_to_claim(claim_id, 'update_claim_summary', {'claim_summary': structured_data})
+
+def ensure_file_evidence(file_record):
+    # Evidence already described (by this claim or any other upload of the same
+    # bytes) is reused; otherwise the file is preprocessed in the evidence pool
+    # and described once
+    if file_record.description:
+        return
+    if not file_record.content_hash:
+        file_record.content_hash = EvidenceFile(file_record.filename, file_record.filepath).content_hash
+    evidence = evidence_cache.get(file_record.content_hash)
+    if not evidence:
+        with span('evidence_preprocess', mime=file_record.filetype):
+            artifacts = get_evidence_pool().submit(
+                preprocess_evidence, file_record.filepath, file_record.filetype, app.config['IMAGE_CACHE_FOLDER'],
+                app.config['MAX_IMAGE_DIMENSION'], app.config['IMAGE_QUALITY'], file_record.content_hash).result()
+        file = EvidenceFile(
+            file_record.filename,
+            artifacts.get('image_path', file_record.filepath),
+            artifacts.get('image_mime', file_record.filetype),
+            file_record.content_hash,
+            pdf_pages=artifacts.get('pdf_pages')
+        )
+        evidence = describe_evidence(file)
+        evidence['pdf_pages'] = artifacts.get('pdf_pages', [])
+        if evidence['description']:
+            evidence_cache.put(file_record.content_hash, evidence)
+    file_record.description = evidence['description'] or None
+    commit()
+
+@traced('job.evidence')
+def preprocess_file_job(file_id):
+    file_record = File.query.filter_by(id=file_id).first()
+    if file_record:
+        ensure_file_evidence(file_record)
+
+def load_claim_files(claim):
+    # Handles only; nothing is read from disk here
     files = []
-    file_records = File.query.filter_by(claim_id=claim.id).all()
-    for file_record in file_records:
-        with open(file_record.filepath, 'rb') as f:
-            file_data = f.read()
-            files.append({
-                'name': file_record.filename,
-                'data': file_data,
-                'type': file_record.filetype,
-                'filepath': file_record.filepath  # Include filepath for PDF processing
-            })
-            
-    structured_data = generate_structured_summary(claim, answers, files, transaction_details, claim.additional_info)
-    claim.structured_data = json.dumps(structured_data)
-    db.session.commit()
-    emit('update_claim_summary', {'claim_summary': structured_data})
-
-def validate_response_with_gpt4(claim_id, question_text, user_response):
-    # Fetch previous messages
-    messages_db = Message.query.filter_by(claim_id=claim_id).order_by(Message.timestamp.desc()).limit(5).all()
-    # Reverse to get the correct order
-    messages_db.reverse()
-
-    # Build the conversation history
-    messages = []
-    for msg in messages_db:
-        role = 'assistant' if msg.sender == 'assistant' else 'user'
-        messages.append({'role': role, 'content': msg.content})
+    for file_record in claim.files:
+        files.append(EvidenceFile(file_record.filename, file_record.filepath, file_record.filetype, file_record.content_hash, file_record.description, file_id=file_record.id))
+    return files
+
+def prepare_evidence(files):
+    # Files are normally described when they are uploaded; only a file without a
+    # stored description is described now, and an image that still has none is
+    # sent as its normalized version
+    for file in files:
+        if file.description:
+            continue
+        file_record = File.query.filter_by(id=file.file_id).first()
+        ensure_file_evidence(file_record)
+        file.description = file_record.description
+        if not file.description and file.mime.startswith('image/'):
+            with span('image_normalize'):
+                file.filepath, file.mime = get_evidence_pool().submit(
+                    normalize_image, file_record.filepath, app.config['IMAGE_CACHE_FOLDER'],
+                    app.config['MAX_IMAGE_DIMENSION'], app.config['IMAGE_QUALITY'], file_record.content_hash).result()
+    return files
+
+SUMMARY_WRITE_ATTEMPTS = 3
+
+def refresh_structured_summary(claim, answers, files, transaction_details):
+    # Summary jobs for one claim can run at the same time on different workers.
+    # The summary is only written if summary_state is still what it was merged
+    # from, and the loser starts again from what the winner wrote (usually with
+    # nothing left to merge). Returns None if it could not be written.
+    for _ in range(SUMMARY_WRITE_ATTEMPTS):
+        summarized_state = claim.summary_state
+        structured_data, changes = summarize_claim_changes(claim, answers, files, transaction_details)
+        if changes is None or write_summary(claim, summarized_state, changes):
+            return structured_data
+        db.session.expire(claim)
+        answers = json.loads(claim.answers or '{}')
+        files = load_claim_files(claim)
+    print(f"Could not save the structured summary for claim {claim.id}")
+    return None
+
+def write_summary(claim, summarized_state, changes):
+    # Compare-and-set on summary_state rather than the claim version, which
+    # every saved answer bumps
+    unchanged = Claim.summary_state.is_(None) if summarized_state is None else Claim.summary_state == summarized_state
+    result = db.session.execute(
+        update(Claim)
+        .where(Claim.id == claim.id, unchanged)
+        .values(**changes)
+        .execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        commit()
+        return False
+    for name, value in changes.items():
+        set_committed_value(claim, name, value)
+    commit()
+    return True
+
+def summarize_claim_changes(claim, answers, files, transaction_details):
+    # Returns the claim's structured summary and the column changes that store
+    # it, or None for the changes when there is nothing to write. Only what
+    # changed since the last summary is sent to the model; falls back to a full
+    # regeneration when there is no previous summary to merge into
+    previous_data = json.loads(claim.structured_data) if claim.structured_data else {}
+    summary_state = json.loads(claim.summary_state) if claim.summary_state else {}
+    summarized_answers = summary_state.get('answers', {})
+    # Files are tracked by File row, since two uploads can share a filename;
+    # states written before that list filenames
+    summarized_file_ids = summary_state.get('file_ids')
+    summarized_files = summary_state.get('files', [])
+    additional_info = claim.additional_info or ''
+
+    if not previous_data or not summary_state:
+        structured_data = generate_structured_summary(claim, answers, prepare_evidence(files), transaction_details, additional_info)
+    else:
+        new_answers = {key: value for key, value in answers.items() if summarized_answers.get(key) != value}
+        if summarized_file_ids is not None:
+            new_files = [file for file in files if file.file_id not in summarized_file_ids]
+        else:
+            new_files = [file for file in files if file.name not in summarized_files]
+        new_additional_info = additional_info if additional_info != summary_state.get('additional_info', '') else ''
+        if not new_answers and not new_files and not new_additional_info:
+            return previous_data, None
+        structured_data = update_structured_summary(claim, previous_data, new_answers, prepare_evidence(new_files), new_additional_info)
+        if structured_data is None:
+            # The merge failed; leave summary_state alone so the delta is sent again
+            return previous_data, None
+
+    changes = {
+        'structured_data': json.dumps(structured_data),
+        'summary_state': json.dumps({
+            'answers': answers,
+            'file_ids': [file.file_id for file in files],
+            'additional_info': additional_info
+        })
+    }
+    changes.update(project_structured_data(structured_data))
+    return structured_data, changes
 
-    # Add the current question and user response
-    messages.append({'role': 'assistant', 'content': question_text})
-    messages.append({'role': 'user', 'content': user_response})
+def validate_response_with_gpt4(claim_id, question_text, user_response, context=None, stream=False):
+    # The context already ends with the question and the user's response. With
+    # stream, a clarification is pushed to the claim's room as it is written and
+    # the result carries its stream_id.
+    if context is None:
+        context = build_conversation_context(Claim.query.options(CLAIM_DETAILS, selectinload(Claim.messages)).filter_by(id=claim_id).first())
 
     # Add system prompt
     system_prompt = "You are an assistant helping to validate user responses to a predefined question in a credit card chargeback process."
-    messages.insert(0, {'role': 'system', 'content': system_prompt})
+    messages = [{'role': 'system', 'content': system_prompt}]
+    messages.extend(context)
 
     # Add instruction to produce JSON output
-    instruction = "Please determine if the user's response adequately answers the question, considering the conversation so far. If not, provide a polite clarification or request for more information, avoiding repeating previous responses. Respond in JSON format: {\"valid\": true/false, \"clarification\": \"Your message here\"}"
+    instruction = f"The user's response \"{user_response}\" is their answer to the question: '{question_text}'. Please determine if the user's response adequately answers the question, considering the conversation so far. If not, provide a polite clarification or request for more information, avoiding repeating previous responses. Respond in JSON format: {{\"valid\": true/false, \"clarification\": \"Your message here\"}}"
     messages.append({'role': 'assistant', 'content': instruction})
 
     # Call GPT-4 API
-    response = client.chat.completions.create(model="gpt-4o",
-    messages=messages,
-    max_tokens=150,
-    temperature=0.5,
-    response_format={ "type": "json_object" })
-
-    assistant_reply = response.choices[0].message.content.strip()
+    stream_id, delta_stream, assistant_reply = None, None, None
+    if stream:
+        stream_id, delta_stream = stream_to_claim(claim_id, 'clarification', when=lambda text: re.search(r'"valid"\s*:\s*false', text))
+        try:
+            assistant_reply = client.stream(call="validation", on_delta=delta_stream.feed, model="gpt-4o",
+            messages=messages,
+            max_tokens=150,
+            temperature=0.5,
+            response_format={ "type": "json_object" }).strip()
+        except StreamInterrupted as e:
+            # Ask again without streaming; the caller's final message with this
+            # stream_id replaces whatever part of the clarification was shown
+            print(f"Validation stream for claim {claim_id} interrupted: {e}")
+    if assistant_reply is None:
+        response = client.chat.completions.create(call="validation", model="gpt-4o",
+        messages=messages,
+        max_tokens=150,
+        temperature=0.5,
+        response_format={ "type": "json_object" })
+        assistant_reply = response.choices[0].message.content.strip()
 
     try:
         result = json.loads(assistant_reply)
         valid = result.get('valid', False)
         clarification = result.get('clarification', '')
-        return {'valid': valid, 'clarification': clarification}
     except json.JSONDecodeError:
         # Default to valid response to avoid blocking the flow
-        return {'valid': True, 'clarification': ''}
+        valid, clarification = True, ''
+    if valid and delta_stream and delta_stream.started:
+        # The broken stream had started a clarification the retry doesn't need;
+        # take back the partial message instead of leaving it hanging
+        emit_to_claim(claim_id, 'message', {'text': '', 'stream_id': stream_id, 'retract': True})
+    return {'valid': valid, 'clarification': clarification, 'stream_id': stream_id}
 
 @socketio.on('upload_file_chunk')
+@traced('event.upload_file_chunk', lambda data: (data.get('data') or {}).get('claimId'))
+@unit_of_work
 def handle_file_chunk(data):
     session_id = request.sid
     data = data.get('data')
     
     claim_id = data.get('claimId')
         
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.filter_by(id=claim_id).first()
 
     filename = data.get('filename')
     chunk_index = data.get('chunk')
@@ -664,65 +1268,193 @@ def handle_file_chunk(data):
     # If all chunks are received, reassemble the file
     if chunk_index + 1 == total_chunks:
         final_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file_hash = hashlib.sha256()
         with open(final_file_path, 'wb') as final_file:
             for i in range(total_chunks):
                 with open(os.path.join(temp_dir, f"chunk_{i}"), 'rb') as chunk_file:
-                    final_file.write(chunk_file.read())
+                    chunk_bytes = chunk_file.read()
+                    file_hash.update(chunk_bytes)
+                    final_file.write(chunk_bytes)
         # Clean up chunks
         for chunk_file in os.listdir(temp_dir):
             os.remove(os.path.join(temp_dir, chunk_file))
         os.rmdir(temp_dir)
 
-        # Save the file record to the database
-        file_record = File(
-            claim_id=claim.id,
-            filename=filename,
-            filepath=final_file_path,
-            filetype=mimetypes.guess_type(filename)[0]
-        )
-        
-        file_upload_message = f'File "{filename}" uploaded successfully.'
-        file_message = Message(claim_id=claim.id, sender='user', content=file_upload_message)
-        db.session.add(file_message)
-        
-        db.session.add(file_record)
-        db.session.commit()
+        register_uploaded_file(claim, filename, final_file_path, file_hash.hexdigest())
+
+def register_uploaded_file(claim, filename, filepath, file_hash):
+    # Save the file record to the database
+    file_record = File(
+        claim_id=claim.id,
+        filename=filename,
+        filepath=filepath,
+        filetype=mimetypes.guess_type(filename)[0],
+        content_hash=file_hash
+    )
+
+    file_upload_message = f'File "{filename}" uploaded successfully.'
+    file_message = add_message(claim, 'user', file_upload_message)
+
+    db.session.add(file_record)
+    db.session.flush()  # Assigns file_record.id for the evidence job
+    commit()
+
+    # Describe the evidence now rather than on the next summary
+    submit_job(claim.id, 'evidence', preprocess_file_job, file_record.id)
+
+    # Notify client of successful upload
+    emit_to_claim(claim.id, 'message', {'text': f'File "{filename}" uploaded successfully.'})
+    emit_to_claim(claim.id, 'message', {'text': 'Please upload any additional files or type "Done" when you are finished.'})
+    return file_record
+
+# Streaming uploads: raw chunks are PUT at their offset into one preallocated
+# file, the client can ask which offsets are already stored to resume, and the
+# SHA-256 is computed while in-order chunks stream through
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_READ_SIZE = 64 * 1024
+upload_hashers = {}  # upload ID -> [running sha256, next offset to hash], only for uploads arriving in order
+upload_hashers_lock = threading.Lock()
+
+def upload_status(upload):
+    return {
+        'upload_id': upload.id,
+        'size': upload.size,
+        'chunk_size': upload.chunk_size,
+        'received': sorted(chunk.offset for chunk in upload.chunks)
+    }
+
+@app.route('/uploads/<int:claim_id>', methods=['POST'])
+def start_upload(claim_id):
+    claim = Claim.query.options(CLAIM_HEADER).filter_by(id=claim_id).first()
+    if not claim:
+        return jsonify({'error': 'Claim not found.'}), 404
+
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    size = data.get('size')
+    if not filename or not isinstance(size, int) or size < 0 or size > app.config['MAX_UPLOAD_BYTES']:
+        return jsonify({'error': 'A filename and a size of at most MAX_UPLOAD_BYTES are required.'}), 400
+    chunk_size = min(max(int(data.get('chunk_size') or UPLOAD_CHUNK_SIZE), UPLOAD_READ_SIZE), 4 * UPLOAD_CHUNK_SIZE)
+
+    upload_id = str(uuid.uuid4())
+    filepath = os.path.join(app.config['PARTIAL_UPLOAD_FOLDER'], upload_id)
+    with open(filepath, 'wb') as f:
+        f.truncate(size)
+
+    upload = Upload(id=upload_id, claim_id=claim.id, filename=filename, filepath=filepath, size=size, chunk_size=chunk_size)
+    db.session.add(upload)
+    commit()
+    with upload_hashers_lock:
+        upload_hashers[upload_id] = [hashlib.sha256(), 0]
+    return jsonify(upload_status(upload))
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    upload = Upload.query.filter_by(id=upload_id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found.'}), 404
+    return jsonify(upload_status(upload))
+
+@app.route('/uploads/<upload_id>/<int:offset>', methods=['PUT'])
+def put_upload_chunk(upload_id, offset):
+    upload = Upload.query.filter_by(id=upload_id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found.'}), 404
+    if offset % upload.chunk_size or offset >= max(upload.size, 1):
+        return jsonify({'error': 'Offset must be a multiple of the chunk size within the file.'}), 400
+    expected_length = min(upload.chunk_size, upload.size - offset)
+
+    # Only extend the running hash if this is the next chunk in order
+    with upload_hashers_lock:
+        hasher = upload_hashers.get(upload_id)
+        if hasher and hasher[1] == offset:
+            hasher[1] = -1  # Claimed by this request
+        else:
+            hasher = None
+
+    written = 0
+    with open(upload.filepath, 'r+b') as f:
+        f.seek(offset)
+        while written < expected_length:
+            piece = request.stream.read(min(UPLOAD_READ_SIZE, expected_length - written))
+            if not piece:
+                break
+            f.write(piece)
+            if hasher:
+                hasher[0].update(piece)
+            written += len(piece)
+
+    if written != expected_length:
+        with upload_hashers_lock:
+            upload_hashers.pop(upload_id, None)  # The hash will be recomputed from the file on completion
+        return jsonify({'error': f'Expected {expected_length} bytes, received {written}.'}), 400
+    if hasher:
+        hasher[1] = offset + written
+
+    if not UploadChunk.query.filter_by(upload_id=upload_id, offset=offset).first():
+        db.session.add(UploadChunk(upload_id=upload_id, offset=offset))
+        commit()
+    return jsonify({'offset': offset, 'length': written})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    upload = Upload.query.filter_by(id=upload_id).first()
+    if not upload:
+        return jsonify({'error': 'Upload not found.'}), 404
+    claim = Claim.query.filter_by(id=upload.claim_id).first()
+
+    received = {chunk.offset for chunk in upload.chunks}
+    missing = [offset for offset in range(0, upload.size, upload.chunk_size) if offset not in received]
+    if missing:
+        return jsonify({'error': 'Upload is incomplete.', 'missing': missing}), 409
+
+    with upload_hashers_lock:
+        hasher = upload_hashers.pop(upload_id, None)
+    if hasher and hasher[1] == upload.size:
+        file_hash = hasher[0].hexdigest()
+    else:
+        # Chunks arrived out of order, were retried or went to another worker
+        file_hash = hashlib.sha256()
+        with open(upload.filepath, 'rb') as f:
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                file_hash.update(block)
+        file_hash = file_hash.hexdigest()
+
+    expected_hash = (request.get_json(silent=True) or {}).get('sha256')
+    if expected_hash and expected_hash.lower() != file_hash:
+        return jsonify({'error': 'Checksum mismatch.', 'sha256': file_hash}), 422
+
+    # Prefixed with the upload ID so an upload never replaces another file of
+    # the same name, whose File rows still describe the old bytes
+    final_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{upload_id}_{upload.filename}")
+    os.replace(upload.filepath, final_file_path)
+    UploadChunk.query.filter_by(upload_id=upload_id).delete()
+    db.session.delete(upload)
+    file_record = register_uploaded_file(claim, upload.filename, final_file_path, file_hash)
+    return jsonify({'filename': file_record.filename, 'sha256': file_hash})
 
-        # Notify client of successful upload
-        emit('message', {'text': f'File "{filename}" uploaded successfully.'}, room=session_id)
-        emit('message', {'text': 'Please upload any additional files or type "Done" when you are finished.'}, room=session_id)
-        
 def create_claim(claim_id):
     session_id = request.sid
     user_uuid = session.get('user_uuid')
-    claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.filter_by(id=claim_id).first()
     if not claim:
         return
 
-    answers = json.loads(claim.answers)
     transaction_details = session.get('transaction_details', {})
 
-    # Get files associated with the claim
-    files = []
-    file_records = File.query.filter_by(claim_id=claim.id).all()
-    for file_record in file_records:
-        with open(file_record.filepath, 'rb') as f:
-            file_data = f.read()
-            files.append({
-                'name': file_record.filename,
-                'data': file_data,
-                'type': file_record.filetype,
-                'filepath': file_record.filepath  # Include filepath for PDF processing
-            })
-    # Generate structured summary using LLM
-    structured_data = generate_structured_summary(claim, answers, files, transaction_details, claim.additional_info)
-    claim.structured_data = json.dumps(structured_data)
-    claim.status = 'Pending'
-    claim.state = ClaimState.COMPLETED.value
+    # Only one event may submit the claim (e.g. "Done" sent twice)
+    submitted = False
+    for _ in range(3):
+        if claim.state == ClaimState.COMPLETED.value:
+            break
+        if update_claim(claim, status='Pending', state=ClaimState.COMPLETED.value, current_question=None, question_index=None):
+            submitted = True
+            break
+    if not submitted:
+        return
 
-    claim.current_question = None  # Reset current question
-    claim.question_index = None
-    db.session.commit()
+    # Generate structured summary using LLM
+    submit_job(claim.id, 'summary', summary_job, claim.id, transaction_details)
 
     # Clear session variables
     session.pop('current_claim_id', None)
@@ -732,30 +1464,53 @@ def create_claim(claim_id):
     emit('message', {'text': f'Your claim has been submitted successfully. Your claim ID is {claim.id}. We will notify you when there is an update.'})
 
     # Save assistant message to chat history
-    message = Message(claim_id=claim.id, sender='assistant', content=f'Your claim has been submitted successfully. Your claim ID is {claim.id}. We will notify you when there is an update.')
-    db.session.add(message)
-    db.session.commit()
+    message = add_message(claim, 'assistant', f'Your claim has been submitted successfully. Your claim ID is {claim.id}. We will notify you when there is an update.')
+    commit()
 
-    # Run expert reviews in a separate thread to avoid blocking
+    # Run expert reviews in the background once the summary job has finished
     if claim.additional_info:
         return
-    run_expert_reviews(claim.id, user_uuid)
+    submit_job(claim.id, 'expert_review', run_expert_reviews, claim.id, user_uuid)
 
+def reopen_claim(claim, reason):
+    # Put a submitted claim that can't be processed back where "Done" submits it again
+    for _ in range(3):
+        if update_claim(claim, status='In Progress', state=ClaimState.FINALIZING.value,
+                        current_question='evidence_available', question_index=len(required_fields)):
+            break
+    text = f'{reason} Please type "Done" to submit it again.'
+    add_message(claim, 'assistant', text)
+    commit()
+    emit_to_claim(claim.id, 'message', {'text': text})
+
+@traced('job.expert_review', lambda claim_id, user_uuid: claim_id)
 def run_expert_reviews(claim_id, user_uuid):
-    with app.app_context():
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_DETAILS).filter_by(id=claim_id).first()
     if not claim:
         return
+    if not claim.structured_data:
+        # The summary job failed
+        reopen_claim(claim, 'We could not prepare the summary of your claim.')
+        return
 
     structured_data = json.loads(claim.structured_data)
 
-    # Chargeback policies expert review
-    chargeback_feedback = chargeback_policies_expert_review(structured_data)
-    print(chargeback_feedback)
+    # Chargeback policies expert review. Claims the date-based rules decide
+    # (delivery not yet overdue, report window passed, ...) skip the LLM
+    chargeback_feedback = None
+    if app.config['POLICY_PRECHECK']:
+        with span('policy_precheck'):
+            chargeback_feedback = precheck_policies(structured_data, claim.transaction_date, claim.created_at)
+    if chargeback_feedback:
+        POLICY_REVIEWS.inc(path='rules')
+    else:
+        chargeback_feedback = chargeback_policies_expert_review(structured_data)
+        POLICY_REVIEWS.inc(path='llm')
     
     expert_feedback = [chargeback_feedback]
     claim.expert_feedback = json.dumps(expert_feedback)
-    db.session.commit()
+    apply_projection(claim, project_expert_feedback(expert_feedback))
+    commit()
 
     # Check if any follow-ups are needed
     follow_up_needed = False
@@ -769,40 +1524,35 @@ def run_expert_reviews(claim_id, user_uuid):
     if follow_up_needed:
         # Send follow-up messages to the user
         for msg in follow_up_messages:
-            emit('message', {'text': "ADDITIONAL INFORMATION REQUIRED: Additional information is required to process your claim: " + msg}, broadcast=True)
+            emit_to_claim(claim_id, 'message', {'text': "ADDITIONAL INFORMATION REQUIRED: Additional information is required to process your claim: " + msg})
             # Save assistant message to chat history
-            message = Message(claim_id=claim.id, sender='assistant', content= "ADDITIONAL INFORMATION REQUIRED: Additional information is required to process your claim: " + msg)
-            db.session.add(message)
-            db.session.commit()
+            message = add_message(claim, 'assistant', "ADDITIONAL INFORMATION REQUIRED: Additional information is required to process your claim: " + msg)
+            commit()
         # Set the claim status back to 'In Progress'
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+        claim = Claim.query.filter_by(id=claim_id).first()
         claim.status = 'Follow-Up Needed'
         claim.state = ClaimState.ADDITIONAL_INFO.value
-        db.session.commit()
+        commit()
     if chargeback_feedback.get('action') == 'wait_for_shipping':
         # Inform the user to wait
         wait_message = 'Please wait for 10 days past the expected delivery date. If the item has not arrived by then, please let us know.'
-        emit('message', {'text': wait_message}, broadcast=True)
+        emit_to_claim(claim_id, 'message', {'text': wait_message})
         # Save assistant message
-        message = Message(claim_id=claim.id, sender='assistant', content=wait_message)
-        db.session.add(message)
-        db.session.commit()
+        message = add_message(claim, 'assistant', wait_message)
+        commit()
         claim.status = 'Waiting'
         claim.state = ClaimState.COLLECTING_INFO.value
-        db.session.commit()
+        commit()
     else:
         # Proceed to send claim to merchant
         send_claim_to_merchant(claim_id)
 
 def send_claim_to_merchant(claim_id):
-    with app.app_context():
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.filter_by(id=claim_id).first()
     if not claim:
         return
 
-    structured_data = json.loads(claim.structured_data)
-    print(structured_data)
-    merchant_email = structured_data['transaction_details']['merchant_email']
+    merchant_email = claim.merchant_email or structured_field(json.loads(claim.structured_data), 'merchant_email')
     merchant_link = f'http://localhost:5000/merchant_view/{claim_id}'
 
     # Send email to merchant (simplified)
@@ -812,15 +1562,14 @@ def send_claim_to_merchant(claim_id):
 
     # Update claim status
     claim.status = 'Awaiting Merchant Response'
-    db.session.commit()
+    commit()
 
 def send_email(to_email, subject, body):
     pass
 
 @app.route('/merchant_view/<int:claim_id>')
 def merchant_view(claim_id):
-    with app.app_context():
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(load_only(Claim.id, Claim.structured_data)).filter_by(id=claim_id).first()
     if not claim:
         return 'Claim not found.', 404
     structured_data = json.loads(claim.structured_data)
@@ -833,8 +1582,7 @@ def merchant_connect(data):
         emit('error', {'message': 'No claim ID provided.'})
         return
     claim_id = int(claim_id)
-    with app.app_context():
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_HEADER).filter_by(id=claim_id).first()
     if not claim:
         emit('error', {'message': 'Invalid claim ID.'})
         return
@@ -842,6 +1590,8 @@ def merchant_connect(data):
     emit('message', {'text': 'Connected to the merchant interface.'})
 
 @socketio.on('merchant_response')
+@traced('event.merchant_response', lambda data: data.get('claim_id'))
+@unit_of_work
 def merchant_response(data):
     claim_id = data.get('claim_id')
     response_text = data.get('text')
@@ -849,8 +1599,7 @@ def merchant_response(data):
         emit('error', {'message': 'Invalid data provided.'})
         return
     claim_id = int(claim_id)
-    with app.app_context():
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.filter_by(id=claim_id).first()
     if not claim:
         emit('error', {'message': 'Invalid claim ID.'})
         return
@@ -858,56 +1607,108 @@ def merchant_response(data):
     # Save merchant response
     claim.merchant_response = response_text
     claim.status = 'Merchant Responded'
-    db.session.commit()
+    commit()
 
     # Proceed to final adjudication
-    threading.Thread(target=perform_final_adjudication, args=(claim_id,)).start()
+    submit_job(claim_id, 'adjudication', perform_final_adjudication, claim_id)
     emit('message', {'text': 'Thank you for your response. We will review the information provided.'})
 
+@traced('job.adjudication', lambda claim_id: claim_id)
 def perform_final_adjudication(claim_id):
-    with app.app_context():
-        claim = Claim.query.filter_by(id=claim_id).with_for_update().first()
+    claim = Claim.query.options(CLAIM_DETAILS).filter_by(id=claim_id).first()
     if not claim:
         return
 
+    if not claim.structured_data:
+        reopen_claim(claim, 'We could not prepare the summary of your claim.')
+        return
+
     structured_data = json.loads(claim.structured_data)
     merchant_response = claim.merchant_response
-    expert_feedback = json.loads(claim.expert_feedback)
+    # Adjudicate without the expert review if it never ran
+    expert_feedback = json.loads(claim.expert_feedback or '[]')
+
+    # Stream the rationale to the user as it is written
+    stream_id, delta_stream = None, None
+    if app.config['STREAM_REPLIES']:
+        stream_id, delta_stream = stream_to_claim(claim_id, 'rationale', prefix=lambda text: f"Your claim has been adjudicated. Decision: {partial_json_field(text, 'decision') or 'Pending'}. Rationale: ")
 
-    adjudication_result = final_adjudication(structured_data, merchant_response, expert_feedback)
+    try:
+        adjudication_result = final_adjudication(structured_data, merchant_response, expert_feedback, delta_stream.feed if delta_stream else None)
+    except StreamInterrupted as e:
+        # The final message below carries the stream_id and replaces the partial rationale
+        print(f"Adjudication stream for claim {claim_id} interrupted: {e}")
+        adjudication_result = final_adjudication(structured_data, merchant_response, expert_feedback)
     claim.adjudication_result = json.dumps(adjudication_result)
+    apply_projection(claim, project_adjudication(adjudication_result))
     claim.status = 'Adjudicated'
-    db.session.commit()
+    commit()
 
     # Notify user of the result
-    user_uuid = claim.user.user_uuid
-
-    session_id = None
-    for sess_id, socket_session in socketio.server.environ.items():
-        socket_user_uuid = socket_session.get('user_uuid', session.get('user_uuid'))
-        if socket_user_uuid == user_uuid:
-            session_id = sess_id
-            break
+    decision = adjudication_result.get('decision', 'Pending')
+    rationale = adjudication_result.get('rationale', '')
+    message = f"Your claim has been adjudicated. Decision: {decision}. Rationale: {rationale}"
 
-    if session_id:
-        decision = adjudication_result.get('decision', 'Pending')
-        rationale = adjudication_result.get('rationale', '')
-        message = f"Your claim has been adjudicated. Decision: {decision}. Rationale: {rationale}"
-        emit('message', {'text': message}, room=session_id)
-
-        # Save assistant message
-        message_record = Message(claim_id=claim.id, sender='assistant', content=message)
-        db.session.add(message_record)
-        db.session.commit()
+    # Save assistant message
+    message_record = add_message(claim, 'assistant', message)
+    commit()
+    emit_to_claim(claim_id, 'message', {'text': message, 'stream_id': stream_id})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print("DISCONNECTING")
     pass
 
+@app.route('/llm_cache/stats')
+def llm_cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition of the stage, LLM and database metrics
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/validation/stats')
+def validation_stats():
+    # How many answers were validated locally and how many needed the LLM
+    local = VALIDATIONS.value(path='local')
+    llm = VALIDATIONS.value(path='llm')
+    return jsonify({'local': local, 'llm': llm, 'llm_fraction': llm / (local + llm) if local + llm else 0.0})
+
+@app.route('/policy/stats')
+def policy_stats():
+    # How many policy reviews the local rules decided and how many needed the LLM
+    rules = POLICY_REVIEWS.value(path='rules')
+    llm = POLICY_REVIEWS.value(path='llm')
+    return jsonify({'rules': rules, 'llm': llm, 'skipped_fraction': rules / (rules + llm) if rules + llm else 0.0})
+
+@app.route('/traces/<int:claim_id>')
+def claim_trace(claim_id):
+    # Recent spans recorded for the claim, to attribute a slow turn to a stage
+    trace_id = trace_id_for(claim_id)
+    return jsonify({'trace_id': trace_id, 'spans': get_trace(trace_id)})
+
 @app.route('/uploaded_files/<filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+PROJECTION_BACKFILL_BATCH = 500
+
+@app.cli.command('backfill-projections')
+def backfill_projections():
+    """Fill in the projected columns for existing claims."""
+    last_id, updated = 0, 0
+    while True:
+        claims = (Claim.query.options(load_only(Claim.id, Claim.structured_data, Claim.expert_feedback, Claim.adjudication_result))
+                  .filter(Claim.id > last_id).order_by(Claim.id).limit(PROJECTION_BACKFILL_BATCH).all())
+        if not claims:
+            break
+        for claim in claims:
+            apply_projection(claim, project_claim(claim))
+        updated += len(claims)
+        last_id = claims[-1].id
+        commit()
+        db.session.expunge_all()
+    print(f"Projected {updated} claims")
+
 if __name__ == '__main__':
     socketio.run(app, debug=False, port=5001, host='0.0.0.0')
@@ -1,19 +1,55 @@
 import io, { Socket } from 'socket.io-client';
 
-interface FileChunkData {
-  filename: string;
-  claimId: number;
-  data: string | ArrayBuffer | null;
-  chunk: number;
-  totalChunks: number;
+interface UploadStatus {
+  upload_id: string;
+  size: number;
+  chunk_size: number;
+  received: number[];
 }
 
 type MessageHandler = (data: any) => void;
 
+// Piece of an assistant reply that is still being written; the final 'message'
+// event with the same stream_id carries the full text, or retract: true when
+// the partial reply should be removed
+interface MessageDelta {
+  stream_id: string;
+  delta: string;
+}
+
+type MessageDeltaHandler = (data: MessageDelta) => void;
+
+interface MessagesPage {
+  messages: any[];
+  claim_summary: any;
+  next_cursor: number | null;
+  has_more: boolean;
+}
+
+// Filters for the claims list; status, state and dispute_category accept several values
+interface ClaimsQuery {
+  status?: string[];
+  state?: string[];
+  dispute_category?: string[];
+  merchant_email?: string;
+  from?: string; // ISO date, inclusive, on the claim's creation time
+  to?: string;
+  q?: string; // Search in the transaction description
+  after?: string | null;
+  limit?: number;
+}
+
+interface ClaimsPage {
+  claims: any[];
+  next_cursor: string | null;
+  has_more: boolean;
+}
+
 class ChargebackClient {
   private baseUrl: string;
   private socket: Socket | null = null;
   private messageHandlers: Set<MessageHandler> = new Set();
+  private messageDeltaHandlers: Set<MessageDeltaHandler> = new Set();
   private connected: boolean = false;
   private structuredData: any = {}; // To store structuredData
   private structuredDataWatchers: Set<(data: any) => void> = new Set(); // Watchers for structuredData
@@ -31,6 +67,8 @@ class ChargebackClient {
       query: {
         claimId: claimId
       },
+      // WebSocket only: long polling needs every request to reach the same worker
+      transports: ['websocket'],
       //@ts-ignore
       maxHttpBufferSize: 1e8,
       pingTimeout: 60000
@@ -55,6 +93,10 @@ class ChargebackClient {
       this.messageHandlers.forEach((handler) => handler(data));
     });
 
+    this.socket.on('message_delta', (data: MessageDelta) => {
+      this.messageDeltaHandlers.forEach((handler) => handler(data));
+    });
+
     return new Promise((resolve) => {
       this.socket!.on('connect', resolve);
     });
@@ -125,9 +167,16 @@ class ChargebackClient {
     return data.id || 0;
   }
 
-  // Get messages for a claim
-  async getMessages(claimId: string): Promise<any[]> {
-    const response = await fetch(`${this.baseUrl}/get_messages/${claimId}`, {
+  // Get one page of messages for a claim, starting after the given message ID
+  async getMessages(claimId: string, after: number | null = null, limit?: number): Promise<MessagesPage> {
+    const url = new URL(`${this.baseUrl}/get_messages/${claimId}`);
+    if (after !== null) {
+      url.searchParams.append('after', after.toString());
+    }
+    if (limit !== undefined) {
+      url.searchParams.append('limit', limit.toString());
+    }
+    const response = await fetch(url.toString(), {
       credentials: 'include', // Include cookies with the request
     });
     if (!response.ok) {
@@ -136,12 +185,45 @@ class ChargebackClient {
     return await response.json();
   }
 
+  // Get one page of claims, newest first, matching the filters; pass next_cursor as `after` for the next page
+  async queryClaims(query: ClaimsQuery = {}): Promise<ClaimsPage> {
+    const url = new URL(`${this.baseUrl}/claims`);
+    Object.entries(query).forEach(([name, value]) => {
+      if (value === undefined || value === null || value === '') return;
+      url.searchParams.append(name, Array.isArray(value) ? value.join(',') : value.toString());
+    });
+    const response = await fetch(url.toString(), {
+      credentials: 'include', // Include cookies with the request
+    });
+    if (!response.ok) {
+      throw new Error('Failed to query claims');
+    }
+    return await response.json();
+  }
+
+  // Get every message after the given message ID (all messages if null), following the pagination cursor
+  async getMessagesSince(claimId: string, after: number | null = null): Promise<MessagesPage> {
+    let page = await this.getMessages(claimId, after);
+    const messages = [...page.messages];
+    while (page.has_more) {
+      page = await this.getMessages(claimId, page.next_cursor);
+      messages.push(...page.messages);
+    }
+    return { ...page, messages };
+  }
+
   // Subscribe to messages
   onMessage(handler: MessageHandler): () => void {
     this.messageHandlers.add(handler);
     return () => this.messageHandlers.delete(handler);
   }
 
+  // Subscribe to streamed pieces of assistant replies
+  onMessageDelta(handler: MessageDeltaHandler): () => void {
+    this.messageDeltaHandlers.add(handler);
+    return () => this.messageDeltaHandlers.delete(handler);
+  }
+
   // Send user response
   sendUserResponse(text: string, claim_id: number): void {
     if (!this.connected) {
@@ -150,52 +232,69 @@ class ChargebackClient {
     this.socket!.emit('user_response', { text, claim_id: claim_id });
   }
 
-  // Upload file in chunks
+  // Upload a file as raw binary chunks over HTTP, skipping chunks the server already has
   async uploadFile(claimId: number, file: File, onProgress?: (progress: number) => void): Promise<void> {
-    const CHUNK_SIZE = 1024 * 1024; // 1MB chunks
-    const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
+    const CHUNK_SIZE = 4 * 1024 * 1024; // 4MB chunks
+
+    const startResponse = await fetch(`${this.baseUrl}/uploads/${claimId}`, {
+      method: 'POST',
+      credentials: 'include',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size, chunk_size: CHUNK_SIZE }),
+    });
+    if (!startResponse.ok) {
+      throw new Error('Failed to start upload');
+    }
+    const upload: UploadStatus = await startResponse.json();
+    await this.uploadMissingChunks(upload, file, onProgress);
+
+    // No client-side digest: hashing here would read the whole file into memory.
+    // The server checks every chunk's length and hashes the file as it arrives,
+    // and returns that sha256.
+    const completeResponse = await fetch(`${this.baseUrl}/uploads/${upload.upload_id}/complete`, {
+      method: 'POST',
+      credentials: 'include',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({}),
+    });
+    if (!completeResponse.ok) {
+      throw new Error('Failed to complete upload');
+    }
+  }
+
+  // Resume an interrupted upload from the chunks the server reports as received
+  async resumeUpload(uploadId: string, file: File, onProgress?: (progress: number) => void): Promise<void> {
+    const response = await fetch(`${this.baseUrl}/uploads/${uploadId}`, {
+      credentials: 'include',
+    });
+    if (!response.ok) {
+      throw new Error('Failed to get upload status');
+    }
+    await this.uploadMissingChunks(await response.json(), file, onProgress);
+  }
+
+  private async uploadMissingChunks(upload: UploadStatus, file: File, onProgress?: (progress: number) => void): Promise<void> {
+    const received = new Set(upload.received);
+    const totalChunks = Math.max(Math.ceil(upload.size / upload.chunk_size), 1);
 
     for (let i = 0; i < totalChunks; i++) {
-      const chunk = file.slice(i * CHUNK_SIZE, (i + 1) * CHUNK_SIZE);
-      const reader = new FileReader();
-
-      await new Promise<void>((resolve, reject) => {
-        reader.onload = async () => {
-          try {
-            await this.uploadFileChunk({
-              filename: file.name,
-              claimId: claimId,
-              data: reader.result,
-              chunk: i,
-              totalChunks,
-            });
-
-            if (onProgress) {
-              onProgress((i + 1) / totalChunks);
-            }
-
-            resolve();
-          } catch (error) {
-            reject(error);
-          }
-        };
-        reader.onerror = reject;
-        reader.readAsDataURL(chunk);
-      });
-    }
-  }
-
-  // Upload a single file chunk
-  private uploadFileChunk(chunkData: FileChunkData): Promise<void> {
-    return new Promise((resolve, reject) => {
-      if (!this.connected) {
-        reject(new Error('Not connected to server'));
-        return;
+      const offset = i * upload.chunk_size;
+      if (!received.has(offset)) {
+        const response = await fetch(`${this.baseUrl}/uploads/${upload.upload_id}/${offset}`, {
+          method: 'PUT',
+          credentials: 'include',
+          headers: { 'Content-Type': 'application/octet-stream' },
+          body: file.slice(offset, offset + upload.chunk_size),
+        });
+        if (!response.ok) {
+          throw new Error(`Failed to upload chunk ${i + 1} of ${totalChunks}`);
+        }
       }
-      console.log('Uploading chunk', chunkData.chunk);
-      this.socket!.emit('upload_file_chunk', {data: chunkData});
-      resolve();
-    });
+
+      if (onProgress) {
+        onProgress((i + 1) / totalChunks);
+      }
+    }
   }
 
   // Get merchant view
@@ -5,10 +5,12 @@ import ClaimSummary from "./components/ClaimSummary";
 import ChargebackClient from "./FrontendIntegration";
 
 interface Message {
+  id?: number; // Server message ID, for messages loaded from the history
   content: string;
   type: "User" | "credit-card" | "Dispute Assistant" | "seller";
   author: string;
   timestamp: string;
+  streamId?: string; // Set while the reply is still streaming in
 }
 
 interface RefundClaimDiscussionProps {
@@ -37,7 +39,7 @@ const RefundClaimDiscussion: React.FC<RefundClaimDiscussionProps> = ({
   const [structuredData, setStructuredData] = useState<any>({claim_summary: {transaction_details: {}, tracking_info: {}}});
 
   const messagesEndRef = useRef<HTMLDivElement | null>(null);
-  const messagesFetchedRef = useRef(false);
+  const lastMessageIdRef = useRef<number | null>(null); // Last message fetched from the server
 
   const [uploadProgress, setUploadProgress] = useState(0);
 
@@ -67,30 +69,46 @@ const RefundClaimDiscussion: React.FC<RefundClaimDiscussionProps> = ({
   };
 
   useEffect(() => {
+    // A different claim starts from an empty conversation and its own cursor
+    lastMessageIdRef.current = null;
+    setMessages([]);
+
     const fetchMessages = async () => {
       try {
         await client.disconnect();
         await client.connect(claimId.toString());
-        if (messagesFetchedRef.current) return; // Prevent duplicate fetches
-  
-        const fetchedMessages = await client.getMessages(claimId.toString());
-        messagesFetchedRef.current = true;
-        
-        // Process and set the messages
-        //@ts-ignore
-        const processedMessages = fetchedMessages.messages.map((message: any) => ({
+
+        // Only fetch messages newer than the last one already shown
+        const after = lastMessageIdRef.current;
+        const fetchedMessages = await client.getMessagesSince(claimId.toString(), after);
+        if (fetchedMessages.next_cursor !== null) {
+          lastMessageIdRef.current = fetchedMessages.next_cursor;
+        }
+
+        const processedMessages: Message[] = fetchedMessages.messages.map((message: any) => ({
+          id: message.id,
           content: message.content,
           author: message.sender,
-          type: getType(message.sender),
+          type: getType(message.sender) as Message["type"],
           timestamp: message.timestamp,
         }));
-  
-        setMessages(processedMessages);
+
+        if (after === null) {
+          // The full history replaces whatever the socket sent while it loaded
+          // (the current question is re-sent on connect and is in the history too)
+          setMessages(processedMessages);
+          return;
+        }
+        // Later fetches only add messages that aren't shown yet
+        setMessages((prevMessages) => {
+          const shown = new Set(prevMessages.filter((msg) => msg.id !== undefined).map((msg) => msg.id));
+          return [...prevMessages, ...processedMessages.filter((msg) => !shown.has(msg.id))];
+        });
       } catch (error) {
         console.error("Failed to fetch messages:", error);
       }
     };
-  
+
     fetchMessages();
     client.addStructuredDataWatcher((data)=>{console.log(data);setStructuredData(data)});
   }, [claimId, client]);
@@ -100,6 +118,20 @@ const RefundClaimDiscussion: React.FC<RefundClaimDiscussionProps> = ({
   useEffect(() => {
     const unsubscribe = client.onMessage((newMessage) => {
       setMessages((prevMessages) => {
+        // The full text of a streamed reply replaces what has streamed in so far,
+        // and a retraction removes it
+        if (newMessage.stream_id) {
+          const index = prevMessages.findIndex((msg) => msg.streamId === newMessage.stream_id);
+          if (newMessage.retract) {
+            return index === -1 ? prevMessages : prevMessages.filter((_, i) => i !== index);
+          }
+          if (index !== -1) {
+            const updated = [...prevMessages];
+            updated[index] = { ...updated[index], content: newMessage.text || "", streamId: undefined };
+            return updated;
+          }
+        }
+
         // Check if message already exists to prevent duplicates
         const messageExists = prevMessages.some(
           (msg) => 
@@ -118,7 +150,28 @@ const RefundClaimDiscussion: React.FC<RefundClaimDiscussionProps> = ({
       });
     });
 
-    return () => unsubscribe();
+    const unsubscribeDelta = client.onMessageDelta(({ stream_id, delta }) => {
+      setMessages((prevMessages) => {
+        const index = prevMessages.findIndex((msg) => msg.streamId === stream_id);
+        if (index === -1) {
+          return [...prevMessages, {
+            content: delta,
+            author: "Dispute Assistant",
+            type: "Dispute Assistant",
+            timestamp: new Date().toISOString(),
+            streamId: stream_id,
+          }];
+        }
+        const updated = [...prevMessages];
+        updated[index] = { ...updated[index], content: updated[index].content + delta };
+        return updated;
+      });
+    });
+
+    return () => {
+      unsubscribe();
+      unsubscribeDelta();
+    };
   }, [client]);
 
   // Auto-scroll effect
@@ -0,0 +1,173 @@
+"""
+End-to-end load test for the claim chat.
+
+Drives concurrent Socket.IO sessions through the whole claim flow
+(start_new_claim -> connect -> five answers -> evidence upload -> "Done") and
+reports p50/p95/p99 latency per event and claims completed per minute.
+
+Run the server against the offline LLM stand-in so results are repeatable and
+need no network:
+
+    LLM_MOCK=1 LLM_MOCK_LATENCY=lognormal:800:0.4 python app.py
+    python loadtest.py --sessions 20 --concurrency 5
+
+Set LLM_REPLAY_PATH to replay responses recorded with LLM_RECORD_PATH.
+"""
+import sys
+import time
+import queue
+import base64
+import argparse
+import threading
+from collections import defaultdict
+
+import requests
+import socketio
+
+ANSWERS = [
+    "I never received the item I ordered.",
+    "It was a pair of running shoes.",
+    "The order was placed on 2023-10-15.",
+    "I contacted the merchant twice by email but got no reply.",
+    "The tracking number is 1Z999AA10123456784.",
+]
+
+# Smallest valid PNG, uploaded as the evidence file
+EVIDENCE_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ClaimSession:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.client = socketio.Client(reconnection=False)
+        self.messages = queue.Queue()
+        self.client.on('message', lambda data: self.messages.put(data.get('text', '')))
+        self.timings = []
+
+    def wait_for(self, predicate=None):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Timed out waiting for a message")
+            text = self.messages.get(timeout=remaining)
+            if predicate is None or predicate(text):
+                return text
+
+    def drain(self):
+        while not self.messages.empty():
+            self.messages.get_nowait()
+
+    def timed(self, event, send, predicate=None):
+        self.drain()
+        start = time.monotonic()
+        send()
+        self.wait_for(predicate)
+        self.timings.append((event, time.monotonic() - start))
+
+    def run(self):
+        start = time.monotonic()
+        response = self.http.get(f"{self.base_url}/start_new_claim", params={
+            'transaction_id': 'TX1234567890',
+            'transaction_description': 'Purchase at ABC Store',
+            'date': '2023-10-15',
+            'merchant_email': 'merchant@example.com',
+            'amount': '100.00',
+        }, timeout=self.timeout)
+        response.raise_for_status()
+        claim_id = response.json()['id']
+        self.timings.append(('start_new_claim', time.monotonic() - start))
+
+        cookies = '; '.join(f"{name}={value}" for name, value in self.http.cookies.items())
+        self.timed('connect', lambda: self.client.connect(
+            f"{self.base_url}?claimId={claim_id}", headers={'Cookie': cookies}, transports=['websocket']
+        ))
+        try:
+            for answer in ANSWERS:
+                self.timed('user_response', lambda: self.client.emit('user_response', {'claim_id': claim_id, 'text': answer}))
+
+            self.timed('upload_file_chunk', lambda: self.client.emit('upload_file_chunk', {'data': {
+                'claimId': claim_id,
+                'filename': 'receipt.png',
+                'chunk': 0,
+                'totalChunks': 1,
+                'data': 'data:image/png;base64,' + base64.b64encode(EVIDENCE_PNG).decode('utf-8'),
+            }}), lambda text: 'uploaded successfully' in text or 'Failed' in text)
+
+            self.timed('submit', lambda: self.client.emit('user_response', {'claim_id': claim_id, 'text': 'Done'}),
+                       lambda text: 'submitted successfully' in text)
+        finally:
+            self.client.disconnect()
+        self.timings.append(('claim_total', time.monotonic() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--sessions', type=int, default=10, help='claims to run in total')
+    parser.add_argument('--concurrency', type=int, default=5, help='claims in flight at once')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for any one reply')
+    parser.add_argument('--max-p95', type=float, default=None, help='exit non-zero if any per-event p95 exceeds this many seconds')
+    args = parser.parse_args()
+
+    timings = defaultdict(list)
+    failures = []
+    pending = queue.Queue()
+    for index in range(args.sessions):
+        pending.put(index)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                return
+            claim_session = ClaimSession(args.url, args.timeout)
+            try:
+                claim_session.run()
+            except Exception as e:
+                with lock:
+                    failures.append(repr(e))
+            with lock:
+                for event, seconds in claim_session.timings:
+                    timings[event].append(seconds)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    completed = len(timings['claim_total'])
+    print(f"{'event':<20}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for event, values in timings.items():
+        print(f"{event:<20}{len(values):>8}{percentile(values, 50):>10.3f}{percentile(values, 95):>10.3f}{percentile(values, 99):>10.3f}")
+    print(f"\n{completed} claims completed, {len(failures)} failed in {elapsed:.1f}s "
+          f"({completed / elapsed * 60:.1f} claims/minute)")
+    for failure in failures[:10]:
+        print(f"  failure: {failure}")
+
+    if failures:
+        sys.exit(1)
+    if args.max_p95 is not None and any(percentile(values, 95) > args.max_p95 for event, values in timings.items() if event != 'claim_total'):
+        print(f"p95 latency above {args.max_p95}s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
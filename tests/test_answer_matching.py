@@ -0,0 +1,40 @@
+import pytest
+
+from utils.answer_matching import match_option
+
+YES_NO = ['Yes', 'No']
+ISSUES = ['Item not received', 'Item damaged', 'Unauthorized transaction', 'Other']
+
+
+@pytest.mark.parametrize('answer', ['n/a', 'n', 'y', 'never', 'not sure', "I'm not sure", 'of course not', 'not correct', 'no idea', 'maybe', "I don't know"])
+def test_negated_or_hedged_answers_need_the_llm(answer):
+    assert match_option(answer, YES_NO) is None
+
+
+@pytest.mark.parametrize('answer, option', [
+    ('yes', 'Yes'),
+    ('Yep, I emailed them', 'Yes'),
+    ('of course', 'Yes'),
+    ('no', 'No'),
+    ('No, I have not', 'No'),
+    ('nope, not yet', 'No'),
+    ('yess', 'Yes'),
+    ('Yes, but they did not reply', 'Yes'),
+])
+def test_clear_yes_no_answers_match(answer, option):
+    assert match_option(answer, YES_NO) == option
+
+
+def test_issue_phrases_match():
+    assert match_option('I have not received it', ISSUES) == 'Item not received'
+    assert match_option('The screen arrived cracked', ISSUES) == 'Item damaged'
+
+
+def test_negated_issue_needs_the_llm():
+    assert match_option('It was not damaged, it never arrived', ISSUES) is None
+
+
+def test_negation_applies_across_the_clause():
+    assert match_option('not an item', ['Item', 'Service']) is None
+    assert match_option('It is not really a physical item', ['Item', 'Service']) is None
+    assert match_option('A service, not an item', ['Item', 'Service']) is None
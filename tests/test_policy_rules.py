@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+import pytest
+
+from utils.policy_rules import parse_date, precheck_policies, DELIVERY_GRACE_DAYS, UNAUTHORIZED_REPORT_DAYS
+
+EXPECTED_DELIVERY = date(2024, 3, 1)
+TRANSACTION_DATE = date(2024, 3, 1)
+
+
+def not_received(delivered=False, notes=''):
+    return {
+        'transaction_details': {'dispute_category': 'Item not received', 'additional_notes': notes},
+        'tracking_info': {'shipment': {'delivered': delivered, 'estimated_arrival': EXPECTED_DELIVERY.isoformat()}},
+    }
+
+
+def unauthorized(notes=''):
+    return {'transaction_details': {'dispute_category': 'Unauthorized transaction', 'additional_notes': notes}}
+
+
+@pytest.mark.parametrize('value, parsed', [
+    ('2024-03-25', date(2024, 3, 25)),
+    ('2024-03-25T10:30:00', date(2024, 3, 25)),
+    ('March 25, 2024', date(2024, 3, 25)),
+    ('03/25/2024', date(2024, 3, 25)),
+    ('25/03/2024', date(2024, 3, 25)),
+    ('03/04/2024', None),
+    ('', None),
+    ('soon', None),
+])
+def test_parse_date(value, parsed):
+    assert parse_date(value) == parsed
+
+
+def test_delivery_not_due_until_the_grace_period_ends():
+    filed_on = EXPECTED_DELIVERY + timedelta(days=DELIVERY_GRACE_DAYS - 1)
+    assert precheck_policies(not_received(), filed_on=filed_on)['rule'] == 'delivery_not_due'
+
+
+def test_delivery_overdue_once_the_grace_period_ends():
+    filed_on = EXPECTED_DELIVERY + timedelta(days=DELIVERY_GRACE_DAYS)
+    assert precheck_policies(not_received(), filed_on=filed_on)['rule'] == 'delivery_overdue'
+
+
+def test_delivered_item_asks_for_an_explanation():
+    feedback = precheck_policies(not_received(delivered=True), filed_on=EXPECTED_DELIVERY)
+    assert feedback['rule'] == 'item_arrived'
+    assert feedback['action'] == 'request_additional_info'
+
+
+def test_report_window_includes_its_last_day():
+    filed_on = TRANSACTION_DATE + timedelta(days=UNAUTHORIZED_REPORT_DAYS)
+    assert precheck_policies(unauthorized(), transaction_date=TRANSACTION_DATE, filed_on=filed_on) is None
+
+
+def test_report_window_passed_the_day_after():
+    filed_on = TRANSACTION_DATE + timedelta(days=UNAUTHORIZED_REPORT_DAYS + 1)
+    feedback = precheck_policies(unauthorized(), transaction_date=TRANSACTION_DATE, filed_on=filed_on)
+    assert feedback['rule'] == 'report_window_passed'
+    assert TRANSACTION_DATE.isoformat() in feedback['additional_info_needed']
+
+
+def test_notes_send_the_claim_to_the_llm():
+    assert precheck_policies(not_received(delivered=True, notes='The box was empty'), filed_on=EXPECTED_DELIVERY) is None
+    filed_on = TRANSACTION_DATE + timedelta(days=UNAUTHORIZED_REPORT_DAYS + 1)
+    assert precheck_policies(unauthorized(notes='I only saw it on my statement last week'),
+                             transaction_date=TRANSACTION_DATE, filed_on=filed_on) is None
+
+
+def test_no_tracking_data_goes_to_the_llm():
+    structured_data = {'transaction_details': {'dispute_category': 'Item not received'}}
+    assert precheck_policies(structured_data, filed_on=EXPECTED_DELIVERY + timedelta(days=30)) is None
+    assert precheck_policies({'transaction_details': {'dispute_category': 'Item not received'}, 'tracking_info': {}},
+                             filed_on=EXPECTED_DELIVERY) is None
@@ -0,0 +1,104 @@
+import re
+import difflib
+
+# Phrases that on their own settle which option an answer means
+OPTION_SYNONYMS = {
+    'yes': ['yes', 'yeah', 'yep', 'yup', 'i have', 'i did', 'have contacted', 'did contact', 'contacted them', 'emailed', 'called them', 'reached out', 'of course'],
+    'no': ['no', 'nope', 'nah', 'not yet', 'i have not', 'i havent', 'i did not', 'i didnt', 'have not contacted', 'havent contacted', 'did not contact', 'didnt contact', 'never contacted'],
+    'item': ['item', 'product', 'goods', 'physical', 'package', 'parcel', 'shipment', 'delivery'],
+    'service': ['service', 'subscription', 'membership', 'booking', 'appointment', 'repair', 'lesson', 'class', 'reservation'],
+    'item not received': ['not received', 'never received', 'didnt receive', 'did not receive', 'havent received', 'have not received', 'never arrived', 'did not arrive', 'didnt arrive', 'not arrived', 'not delivered', 'never delivered', 'never came', 'lost in the mail', 'never got'],
+    'item damaged': ['damaged', 'broken', 'defective', 'cracked', 'faulty', 'smashed', 'shattered', 'torn', 'dented', 'not working', 'doesnt work', 'does not work'],
+    'unauthorized transaction': ['unauthorized', 'unauthorised', 'fraud', 'fraudulent', 'not me', 'did not make', 'didnt make', 'dont recognize', 'do not recognize', 'dont recognise', 'stolen card', 'card was stolen'],
+    'other': ['other'],
+}
+# Words that turn a phrase in the same clause around ("not sure", "of course not", "not an item")
+NEGATIONS = {'not', 'no', 'never', 'dont', 'didnt', 'doesnt', 'isnt', 'wasnt', 'arent', 'werent', 'cant', 'cannot',
+             'havent', 'hasnt', 'hadnt', 'wont', 'without', 'neither', 'nor'}
+# Answers that say the cardholder doesn't know are never a clear choice
+HEDGES = ['no idea', 'not sure', 'unsure', 'not certain', 'dont know', 'do not know', 'dont remember', 'do not remember',
+          'cant remember', 'cannot remember', 'maybe', 'perhaps', 'probably', 'i think', 'i guess']
+FUZZY_MIN_RATIO = 0.8  # Similarity a short answer needs to an option or synonym to count as a typo of it
+FUZZY_MARGIN = 0.1  # Lead the best option needs over the runner-up
+FUZZY_MAX_WORDS = 3  # Longer answers are only matched by phrase
+CLAUSE_BREAK = re.compile(r'[,.;:!?]+|\bbut\b', re.IGNORECASE)  # Where a negation stops applying
+
+
+def normalize(text):
+    text = (text or '').lower().replace("'", '').replace('’', '')
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def phrase_matches(answer, options):
+    # (start, end, option) for every synonym or option name found in the answer
+    matches = []
+    for option in options:
+        for phrase in set(OPTION_SYNONYMS.get(normalize(option), []) + [normalize(option)]):
+            for found in re.finditer(r'\b%s\b' % re.escape(phrase), answer):
+                matches.append((found.start(), found.end(), option))
+    # A phrase inside a longer matched phrase ("i have" in "i have not") doesn't count
+    return [match for match in matches
+            if not any(other[0] <= match[0] and match[1] <= other[1] and (other[1] - other[0]) > (match[1] - match[0]) for other in matches)]
+
+
+def split_clauses(text):
+    # Normalized clauses of the raw answer; normalize() drops the punctuation between them
+    return [clause for clause in (normalize(part) for part in CLAUSE_BREAK.split(text or '')) if clause]
+
+
+def is_negated(match, matches, clause):
+    # A negation anywhere in a phrase's clause flips it, unless the negation is
+    # part of a phrase for the same option ("no, i have not")
+    option = match[2]
+    for word in re.finditer(r'\w+', clause):
+        if word.group() not in NEGATIONS:
+            continue
+        if not any(other[2] == option and other[0] <= word.start() and word.end() <= other[1] for other in matches):
+            return True
+    return False
+
+
+def fuzzy_match(answer, options):
+    scores = []
+    for option in options:
+        candidates = OPTION_SYNONYMS.get(normalize(option), []) + [normalize(option)]
+        scores.append((max(difflib.SequenceMatcher(None, answer, candidate).ratio() for candidate in candidates), option))
+    scores.sort(reverse=True)
+    best_score, best_option = scores[0]
+    runner_up = scores[1][0] if len(scores) > 1 else 0
+    if best_score >= FUZZY_MIN_RATIO and best_score - runner_up >= FUZZY_MARGIN:
+        return best_option
+    return None
+
+
+def match_option(answer, options):
+    """
+    Match a free-text answer to one of a question's options using normalized
+    comparison, a synonym table and fuzzy matching for typos. Returns the
+    option when the answer clearly means exactly one of them, or None when the
+    match is missing, negated, hedged or ambiguous and the answer needs the LLM.
+    """
+    raw_answer, answer = answer, normalize(answer)
+    if not answer or not options:
+        return None
+    for option in options:
+        if answer == normalize(option):
+            return option
+
+    if any(re.search(r'\b%s\b' % re.escape(hedge), answer) for hedge in HEDGES):
+        return None
+
+    matched = set()
+    for clause in split_clauses(raw_answer):
+        matches = phrase_matches(clause, options)
+        if any(is_negated(match, matches, clause) for match in matches):
+            return None
+        matched.update(option for _, _, option in matches)
+    if len(matched) == 1:
+        return matched.pop()
+    if matched:
+        return None
+
+    if len(answer.split()) <= FUZZY_MAX_WORDS:
+        return fuzzy_match(answer, options)
+    return None
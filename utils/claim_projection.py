@@ -0,0 +1,83 @@
+import json
+
+from utils.answer_matching import match_option
+
+# Claim column -> its maximum length; values are clipped to fit
+PROJECTED_COLUMNS = {
+    'dispute_category': 50,
+    'item_or_service': 20,
+    'tracking_number': 100,
+    'expert_action': 50,
+    'decision': 20,
+}
+
+# Canonical values of the option columns; also the options of the matching claim questions
+DISPUTE_CATEGORIES = ['Item not received', 'Item damaged', 'Unauthorized transaction', 'Other']
+ITEM_OR_SERVICE = ['Item', 'Service']
+
+
+def load_json(text, default):
+    if not text:
+        return default
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return default
+
+
+def structured_field(structured_data, name):
+    # Summary fields live under transaction_details, or at the top level in older summaries
+    transaction_details = structured_data.get('transaction_details')
+    if isinstance(transaction_details, dict) and name in transaction_details:
+        return transaction_details.get(name)
+    return structured_data.get(name)
+
+
+def clean(value, column):
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    value = str(value).strip()
+    return value[:PROJECTED_COLUMNS[column]] or None
+
+
+def canonical(value, options, default=None):
+    # The option the model's wording means ("Item Not Received", "Physical goods"),
+    # so exact filters on the column find every spelling
+    if not value:
+        return None
+    return match_option(value, options) or default
+
+
+def project_structured_data(structured_data):
+    if not isinstance(structured_data, dict):
+        structured_data = {}
+    values = {column: clean(structured_field(structured_data, column), column)
+              for column in ('dispute_category', 'item_or_service', 'tracking_number')}
+    values['dispute_category'] = canonical(values['dispute_category'], DISPUTE_CATEGORIES, default='Other')
+    values['item_or_service'] = canonical(values['item_or_service'], ITEM_OR_SERVICE)
+    return values
+
+
+def project_expert_feedback(expert_feedback):
+    # The chargeback policy review is the feedback entry that carries an action
+    action = None
+    if isinstance(expert_feedback, list):
+        action = next((entry.get('action') for entry in expert_feedback if isinstance(entry, dict) and entry.get('action')), None)
+    return {'expert_action': clean(action, 'expert_action')}
+
+
+def project_adjudication(adjudication_result):
+    decision = adjudication_result.get('decision') if isinstance(adjudication_result, dict) else None
+    decision = clean(decision, 'decision')
+    return {'decision': decision.lower() if decision else None}
+
+
+def project_claim(claim):
+    """
+    Column values for every projected field, read from the claim's
+    structured_data, expert_feedback and adjudication_result JSON.
+    """
+    values = project_structured_data(load_json(claim.structured_data, {}))
+    values.update(project_expert_feedback(load_json(claim.expert_feedback, [])))
+    values.update(project_adjudication(load_json(claim.adjudication_result, {})))
+    return values
@@ -0,0 +1,40 @@
+def estimate_tokens(text):
+    # Rough estimate (about four characters per token for English text)
+    return len(text or '') // 4 + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    # Keep the start and the end of a text that is over max_tokens
+    max_chars = max(max_tokens - 1, 0) * 4
+    if len(text or '') <= max_chars:
+        return text
+    marker = '\n[...]\n'
+    keep = max(max_chars - len(marker), 0)
+    return text[:keep // 2] + marker + text[len(text) - (keep - keep // 2):]
+
+
+def build_context_window(conversation, summary='', token_budget=3000):
+    """
+    Keep the most recent messages of a conversation that fit in token_budget,
+    preceded by the rolling summary of everything older.
+    conversation is a list of {'role', 'content'} dicts, oldest first.
+    """
+    # The summary never takes more than half the budget, and the newest message
+    # is cut down to whatever is left rather than overrunning it
+    summary = truncate_to_tokens(summary, token_budget // 2) if summary else ''
+    window = []
+    used = estimate_tokens(summary) if summary else 0
+    for message in reversed(conversation):
+        tokens = estimate_tokens(message['content'])
+        if used + tokens > token_budget:
+            if window:
+                break
+            message = dict(message, content=truncate_to_tokens(message['content'], token_budget - used))
+            tokens = estimate_tokens(message['content'])
+        window.append(message)
+        used += tokens
+    window.reverse()
+
+    if summary:
+        window.insert(0, {'role': 'system', 'content': f"Summary of the earlier conversation:\n{summary}"})
+    return window
@@ -0,0 +1,68 @@
+import time
+
+from sqlalchemy import event, inspect, text
+
+from utils.metrics import DB_SECONDS
+
+
+def engine_options(database_uri, pool_size=10, max_overflow=20, busy_timeout_ms=5000):
+    if database_uri.startswith('sqlite'):
+        # SQLite has a single writer; wait for the lock instead of failing with
+        # "database is locked", and allow connections to move between green threads
+        return {'connect_args': {'timeout': busy_timeout_ms / 1000, 'check_same_thread': False}}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    }
+
+
+def configure_sqlite(engine, busy_timeout_ms=5000):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the writer
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+def instrument_queries(engine):
+    # Time every statement the engine executes into the query latency histogram
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_start'].pop()
+        words = statement.split(None, 1)
+        DB_SECONDS.observe(time.perf_counter() - started, operation=words[0].lower() if words else 'unknown')
+
+
+def add_missing_columns(engine, table):
+    """
+    Add the model columns a table created by an older version is missing, and
+    any of its indexes that don't exist yet. create_all only creates missing
+    tables, never columns. Returns the names of the columns added.
+    """
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = f'{column.name} {column.type.compile(dialect=engine.dialect)}'
+            if column.server_default is not None:
+                definition += f" DEFAULT '{column.server_default.arg}'"
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {definition}'))
+            added.append(column.name)
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+    return added
@@ -0,0 +1,50 @@
+import base64
+import mmap
+import hashlib
+
+from utils.metrics import span
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class EvidenceFile:
+    """
+    Lazy handle on an evidence file. Holds the name, path, MIME type and any
+    derived text (description, PDF pages) without reading the file; bytes are
+    only read, through a memory map, when something asks for them.
+    """
+
+    def __init__(self, name, filepath, mime=None, content_hash=None, description=None, pdf_pages=None, file_id=None):
+        self.file_id = file_id  # File record this handle was loaded from, if any
+        self.name = name
+        self.filepath = filepath
+        self.mime = mime or ''
+        self._content_hash = content_hash
+        self.description = description
+        self.pdf_pages = pdf_pages
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            file_hash = hashlib.sha256()
+            with open(self.filepath, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    file_hash.update(block)
+            self._content_hash = file_hash.hexdigest()
+        return self._content_hash
+
+    def open(self):
+        return open(self.filepath, 'rb')
+
+    def read_base64(self):
+        # Encode straight from the memory map instead of reading a copy first
+        with span('file_read', mime=self.mime), self.open() as f:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return base64.b64encode(mapped).decode('utf-8')
+            except ValueError:
+                # Empty files can't be mapped
+                return ''
+
+    def __repr__(self):
+        return f"EvidenceFile({self.name!r}, {self.mime!r})"
@@ -0,0 +1,73 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+
+class EvidenceCache:
+    """
+    Persistent cache of per-file evidence (extracted PDF text and the model
+    generated description), keyed by the SHA-256 of the uploaded bytes.
+    Entries are stored as JSON files and evicted least recently used first
+    once the folder grows past max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes=50 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # content hash -> size on disk, least recently used first
+        self.total_bytes = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._load_index()
+
+    def _load_index(self):
+        # Rebuild the LRU order from the last access times on disk
+        cached = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            stat = os.stat(os.path.join(self.folder, name))
+            cached.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+        for _, key, size in sorted(cached):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            try:
+                with open(self._path(key), 'r') as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            os.utime(self._path(key))
+            return entry
+
+    def put(self, key, entry):
+        data = json.dumps(entry)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            with open(self._path(key), 'w') as f:
+                f.write(data)
+            size = len(data.encode('utf-8'))
+            self.entries[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
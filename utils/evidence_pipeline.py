@@ -0,0 +1,27 @@
+from PyPDF2 import PdfReader
+
+from utils.image_utils import normalize_image
+
+
+# These functions run in a separate process so PDF parsing and image decoding
+# don't block the eventlet hub; they only take and return picklable values.
+
+def extract_pdf_pages(filepath):
+    pages = []
+    try:
+        pdf_reader = PdfReader(filepath)
+        for page in pdf_reader.pages:
+            pages.append(page.extract_text() or "")
+    except Exception as e:
+        print(f"Error extracting text from {filepath}: {e}")
+    return pages
+
+
+def preprocess_evidence(filepath, filetype, image_cache_folder, max_image_dimension=1568, image_quality=85, file_hash=None):
+    filetype = filetype or ''
+    if filetype == 'application/pdf':
+        return {'pdf_pages': extract_pdf_pages(filepath)}
+    if filetype.startswith('image/'):
+        image_path, image_mime = normalize_image(filepath, image_cache_folder, max_image_dimension, image_quality, file_hash)
+        return {'image_path': image_path, 'image_mime': image_mime}
+    return {}
@@ -0,0 +1,62 @@
+import io
+import os
+import hashlib
+import mimetypes
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+NORMALIZED_FORMATS = {
+    'JPEG': ('image/jpeg', '.jpg'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+
+def normalize_image(filepath, cache_folder, max_dimension=1568, quality=85, file_hash=None):
+    """
+    Decode an image, apply its EXIF orientation, shrink it so its longest side
+    is at most max_dimension and re-encode it without metadata (JPEG, or WebP
+    when it has transparency). The result is cached on disk keyed by the
+    content hash of the original file and the settings.
+    Returns (path to the normalized image, MIME type).
+    """
+    original_mime = mimetypes.guess_type(filepath)[0] or 'image/jpeg'
+    if Image is None:
+        return filepath, original_mime
+
+    if file_hash is None:
+        with open(filepath, 'rb') as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+    key = f"{file_hash}_{max_dimension}_{quality}"
+    for image_format, (mime, extension) in NORMALIZED_FORMATS.items():
+        cached_path = os.path.join(cache_folder, key + extension)
+        if os.path.exists(cached_path):
+            return cached_path, mime
+
+    try:
+        with Image.open(filepath) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension))
+            has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+            if has_alpha:
+                image_format = 'WEBP'
+                image = image.convert('RGBA')
+            else:
+                image_format = 'JPEG'
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, format=image_format, quality=quality, optimize=True)
+    except Exception as e:
+        print(f"Error normalizing image {filepath}: {e}")
+        return filepath, original_mime
+
+    mime, extension = NORMALIZED_FORMATS[image_format]
+    os.makedirs(cache_folder, exist_ok=True)
+    cached_path = os.path.join(cache_folder, key + extension)
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(output.getvalue())
+    os.replace(temp_path, cached_path)
+    return cached_path, mime
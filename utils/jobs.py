@@ -0,0 +1,92 @@
+import uuid
+import contextvars
+import queue
+import threading
+from collections import deque
+from contextlib import nullcontext
+
+
+class Job:
+    def __init__(self, claim_id, name, fn, args, kwargs):
+        self.id = str(uuid.uuid4())
+        self.claim_id = claim_id
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.context = contextvars.copy_context()  # e.g. the trace of the event that submitted it
+
+
+class JobQueue:
+    """
+    Bounded worker pool for slow claim work (summaries, expert reviews,
+    adjudication). At most max_workers jobs run at once, which caps the number
+    of concurrent requests to the LLM API, and jobs for the same claim run one
+    at a time in the order they were submitted.
+
+    on_event(job) is called whenever a job is queued, starts, finishes or fails.
+    context() is entered around every job, e.g. app.app_context, and the job
+    runs with the context variables of the code that submitted it.
+    """
+
+    def __init__(self, max_workers=4, on_event=None, context=None):
+        self.max_workers = max_workers
+        self.on_event = on_event
+        self.context = context or nullcontext
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.claim_jobs = {}  # claim id -> jobs waiting behind the one currently queued or running
+        self.workers = []
+
+    def submit(self, claim_id, name, fn, *args, **kwargs):
+        job = Job(claim_id, name, fn, args, kwargs)
+        with self.lock:
+            self._start_workers()
+            if claim_id in self.claim_jobs:
+                self.claim_jobs[claim_id].append(job)
+            else:
+                self.claim_jobs[claim_id] = deque()
+                self.pending.put(job)
+        self._notify(job)
+        return job.id
+
+    def _start_workers(self):
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            job.status = 'running'
+            self._notify(job)
+            try:
+                job.context.run(self._run, job)
+                job.status = 'done'
+            except Exception as e:
+                print(f"Error in job {job.name} for claim {job.claim_id}: {e}")
+                job.status = 'failed'
+            self._notify(job)
+
+            # Release the claim to the next job waiting on it
+            with self.lock:
+                waiting = self.claim_jobs[job.claim_id]
+                if waiting:
+                    self.pending.put(waiting.popleft())
+                else:
+                    del self.claim_jobs[job.claim_id]
+
+    def _run(self, job):
+        with self.context():
+            job.fn(*job.args, **job.kwargs)
+
+    def _notify(self, job):
+        if not self.on_event:
+            return
+        try:
+            with self.context():
+                self.on_event(job)
+        except Exception as e:
+            print(f"Error reporting progress of job {job.name}: {e}")
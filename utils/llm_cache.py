@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+
+from utils.ttl_cache import TTLCache
+
+
+def normalize_messages(messages):
+    normalized = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            content = content.strip()
+        normalized.append({'role': message.get('role'), 'content': content})
+    return normalized
+
+
+def cache_key(model, messages, params):
+    payload = json.dumps({'model': model, 'messages': normalize_messages(messages), 'params': params}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache of chat completion responses: an in-memory TTL/LRU tier and
+    an optional SQLite file on disk that several worker processes can share.
+    """
+
+    def __init__(self, max_size=2048, ttl=3600, disk_path=None, disk_max_entries=50000):
+        self.memory = TTLCache(max_size=max_size, ttl=ttl)
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path:
+            with closing(self._connect()) as connection, connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)')
+                connection.execute('CREATE INDEX IF NOT EXISTS ix_responses_expires_at ON responses (expires_at)')
+
+    def _connect(self):
+        # The connection's own context manager only commits, so callers wrap it in closing()
+        connection = sqlite3.connect(self.disk_path, timeout=5)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            with self.lock:
+                self.hits += 1
+            return value
+
+        if self.disk_path:
+            try:
+                with closing(self._connect()) as connection, connection:
+                    row = connection.execute('SELECT value FROM responses WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+            except sqlite3.Error as e:
+                print(f"Error reading LLM response cache: {e}")
+                row = None
+            if row:
+                value = json.loads(row[0])
+                self.memory.set(key, value)
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if not self.disk_path:
+            return
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.execute('INSERT OR REPLACE INTO responses (key, expires_at, value) VALUES (?, ?, ?)', (key, time.time() + self.ttl, json.dumps(value)))
+                connection.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),))
+                connection.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires_at DESC LIMIT -1 OFFSET ?)', (self.disk_max_entries,))
+        except sqlite3.Error as e:
+            print(f"Error writing LLM response cache: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': self.memory.stats()['size']
+            }
+
+
+# Shared by every LLM call in the process
+response_cache = LLMResponseCache(
+    max_size=int(os.getenv('LLM_CACHE_SIZE', 2048)),
+    ttl=int(os.getenv('LLM_CACHE_TTL', 3600)),
+    disk_path=os.getenv('LLM_CACHE_PATH') or None
+)
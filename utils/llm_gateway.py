@@ -0,0 +1,286 @@
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+from types import SimpleNamespace
+
+import httpx
+import openai
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+from utils.llm_cache import cache_key, response_cache
+from utils.context_window import estimate_tokens
+from utils.mock_llm import ReplayLLMClient, RecordingLLMClient
+from utils.metrics import span, LLM_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_REQUESTS, LLM_TOKENS
+
+# Priority lanes: lower runs first
+INTERACTIVE = 0  # The user is waiting on the reply (validation, redundancy checks)
+BACKGROUND = 1  # Summaries, expert reviews, adjudication
+
+IMAGE_TOKEN_ESTIMATE = 1000
+
+
+class TokenBucket:
+    """
+    Allows up to per_minute units a minute, refilled continuously. 0 disables
+    it. Waiting requests are served best priority first, so an INTERACTIVE
+    request that arrives while BACKGROUND ones wait for the budget goes ahead
+    of them.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1, priority=INTERACTIVE):
+        if not self.capacity:
+            return
+        amount = min(amount, self.capacity)
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            # Wake the current head so a better priority can take its place
+            self.condition.notify_all()
+            try:
+                while True:
+                    self._refill()
+                    if self.waiting[0] == ticket:
+                        if self.tokens >= amount:
+                            self.tokens -= amount
+                            return
+                        # Only the head sleeps until the budget refills
+                        self.condition.wait((amount - self.tokens) / self.rate)
+                    else:
+                        self.condition.wait()
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+
+class PriorityGate:
+    """
+    Limits in-flight requests to slots, handing free slots to the waiting
+    request with the best priority. reserved slots are kept for INTERACTIVE
+    requests so background work can never take all of them.
+    """
+
+    def __init__(self, slots, reserved=1):
+        self.slots = slots
+        self.reserved = min(reserved, slots - 1)
+        self.active = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def _has_slot(self, priority):
+        limit = self.slots if priority == INTERACTIVE else self.slots - self.reserved
+        return self.active < limit
+
+    def acquire(self, priority):
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            while self.waiting[0] != ticket or not self._has_slot(priority):
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.active += 1
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+
+class StreamInterrupted(Exception):
+    """A streamed call failed after part of the reply had already been passed on."""
+
+
+def estimate_request_tokens(kwargs):
+    tokens = kwargs.get('max_tokens') or 0
+    for message in kwargs.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'text':
+                    tokens += estimate_tokens(part.get('text'))
+                else:
+                    tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+class LLMGateway:
+    """
+    The one OpenAI client used by the app. Calls go through
+    gateway.chat.completions.create(priority=..., call=..., **openai_arguments),
+    which serves temperature-0 calls from the response cache and otherwise
+    applies the priority lanes, the request/token per minute budgets, a per-call
+    timeout and jittered retries on rate limits, server errors and timeouts.
+    call names the call in the latency, token and span metrics. gateway.stream
+    is the streaming variant for replies shown to the user as they are written.
+    """
+
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError, openai.APITimeoutError)
+
+    def __init__(self, api_key, timeout=60, max_retries=4, max_inflight=8, requests_per_minute=0, tokens_per_minute=0, cache=None, client=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache = cache
+        # One pooled HTTP client shared by every call, unless a stand-in is injected
+        self.client = client or OpenAI(
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=0,
+            http_client=httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_inflight * 2, max_keepalive_connections=max_inflight)
+            )
+        )
+        self.gate = PriorityGate(max_inflight)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, priority=INTERACTIVE, call='unnamed', **kwargs):
+        with span(f'llm.{call}'):
+            key = None
+            if self.cache and kwargs.get('temperature') == 0 and not kwargs.get('stream'):
+                params = {name: value for name, value in kwargs.items() if name not in ('model', 'messages', 'timeout')}
+                key = cache_key(kwargs.get('model'), kwargs.get('messages', []), params)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    LLM_REQUESTS.inc(call=call, outcome='cache_hit')
+                    return ChatCompletion.model_validate(cached)
+
+            kwargs.setdefault('timeout', self.timeout)
+            try:
+                response = self._call(priority, call, kwargs)
+            except Exception:
+                LLM_REQUESTS.inc(call=call, outcome='error')
+                raise
+            LLM_REQUESTS.inc(call=call, outcome='ok')
+            self._record_usage(call, getattr(response, 'usage', None))
+            if key:
+                self.cache.set(key, response.model_dump())
+            return response
+
+    def stream(self, priority=INTERACTIVE, call='unnamed', on_delta=None, **kwargs):
+        """
+        Streams the completion, calling on_delta(text) with each piece of content
+        as it arrives, and returns the full content. Streamed calls are never
+        cached and are only retried if they fail before the first piece.
+        """
+        with span(f'llm.{call}', stream=True):
+            kwargs.setdefault('timeout', self.timeout)
+            kwargs.update(stream=True, stream_options={'include_usage': True})
+            requested = time.perf_counter()
+
+            def consume(chunks):
+                pieces = []
+                usage = None
+                try:
+                    for chunk in chunks:
+                        usage = chunk.usage or usage
+                        for choice in chunk.choices:
+                            piece = choice.delta.content
+                            if not piece:
+                                continue
+                            if not pieces:
+                                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - requested, call=call)
+                            pieces.append(piece)
+                            if on_delta:
+                                on_delta(piece)
+                except self.RETRYABLE_ERRORS as e:
+                    if pieces:
+                        raise StreamInterrupted(str(e)) from e
+                    raise
+                return ''.join(pieces), usage
+
+            try:
+                content, usage = self._call(priority, call, kwargs, consume)
+            except Exception:
+                LLM_REQUESTS.inc(call=call, outcome='error')
+                raise
+            LLM_REQUESTS.inc(call=call, outcome='ok')
+            self._record_usage(call, usage)
+            return content
+
+    def _record_usage(self, call, usage):
+        if usage:
+            LLM_TOKENS.inc(usage.prompt_tokens or 0, call=call, kind='prompt')
+            LLM_TOKENS.inc(usage.completion_tokens or 0, call=call, kind='completion')
+
+    def _call(self, priority, call, kwargs, consume=None):
+        # consume(response), if given, runs while the slot is still held, e.g.
+        # to read a streamed response
+        tokens = estimate_request_tokens(kwargs)
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire(priority=priority)
+            self.token_bucket.acquire(tokens, priority)
+            self.gate.acquire(priority)
+            started = time.perf_counter()
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+                return consume(response) if consume else response
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            finally:
+                self.gate.release()
+                LLM_SECONDS.observe(time.perf_counter() - started, call=call, model=kwargs.get('model', ''))
+            time.sleep(delay)
+
+    def _retry_delay(self, error, attempt):
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(30, 2 ** attempt))
+
+
+def backend_client():
+    """
+    LLM_MOCK=1 swaps the OpenAI API for the offline replay client (optionally
+    replaying LLM_REPLAY_PATH, with LLM_MOCK_LATENCY simulated time to first
+    token and LLM_MOCK_TOKEN_LATENCY between tokens), and
+    LLM_RECORD_PATH records real responses for later replay.
+    """
+    if os.getenv('LLM_MOCK'):
+        return ReplayLLMClient(os.getenv('LLM_REPLAY_PATH') or None, os.getenv('LLM_MOCK_LATENCY') or None, os.getenv('LLM_MOCK_TOKEN_LATENCY') or None)
+    if os.getenv('LLM_RECORD_PATH'):
+        return RecordingLLMClient(OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0), os.getenv('LLM_RECORD_PATH'))
+    return None
+
+
+gateway = LLMGateway(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    timeout=float(os.getenv('LLM_TIMEOUT', 60)),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', 4)),
+    max_inflight=int(os.getenv('LLM_MAX_INFLIGHT', 8)),
+    requests_per_minute=int(os.getenv('LLM_REQUESTS_PER_MINUTE', 0)),
+    tokens_per_minute=int(os.getenv('LLM_TOKENS_PER_MINUTE', 0)),
+    cache=response_cache,
+    client=backend_client()
+)
@@ -1,24 +1,18 @@
 import os
-import base64
 
 import requests
 
 import json
-from openai import OpenAI
-
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 from PyPDF2 import PdfReader
-from openai import OpenAI
 import uuid
 
-
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+from utils.llm_gateway import gateway as client, BACKGROUND
+from utils.metrics import span
 
 # Set up OpenAI API key
   # Ensure your API key is set in environment variables
 
 def generate_structured_summary(claim, answers, files, transaction_details, additional_info=""):
-    print(answers)
     messages = [
         {
             "role": "system",
@@ -61,29 +55,54 @@ Additional Information:
     ]
 
     # Process files to generate evidence descriptions
+    messages.extend(build_evidence_messages(files))
+
+    # Add instruction to produce JSON output
+    messages.append({
+        "role": "assistant",
+        "content": "Please provide the structured summary in JSON format as specified."
+    })
+
+    # Call the OpenAI API
+    response = client.chat.completions.create(priority=BACKGROUND, call="summary", model="gpt-4o",
+    messages=messages,
+    max_tokens=1000,
+    temperature=0.5,
+    response_format={ "type": "json_object" })
+
+    structured_summary = response.choices[0].message.content.strip()
+    try:
+        structured_data = json.loads(structured_summary)
+        shipping_info = shipping_expert_review(messages, structured_data)
+        structured_data["tracking_info"] = shipping_info
+    except json.JSONDecodeError:
+        structured_data = {}
+    return structured_data
+
+def build_evidence_messages(files):
+    # files are EvidenceFile handles; bytes are only read for files without a description
+    messages = []
     for file in files:
-        file_type = file.get('type', '')
-        file_name = file['name']
-        if file_type.startswith('image/'):
+        file_type = file.mime
+        file_name = file.name
+        if file.description:
+            # Send the cached description instead of the raw file
+            messages.append({
+                "role": "user",
+                "content": f"Attached is a file named {file_name}. Description of its contents:\n\"\"\"\n{file.description}\n\"\"\"\nPlease include any relevant details in the evidence summary."
+            })
+        elif file_type.startswith('image/'):
             # Include the image in the messages
-            image_base64 = base64.b64encode(file['data']).decode('utf-8')
+            image_base64 = file.read_base64()
             messages.append({
                 "role": "user",
                 "content": [{"type": "text", "text": f"Attached is an image file named {file_name}. Please analyze it and include any relevant details in the evidence summary."}, {
                 "type": "image_url",
                 "image_url": {
-                "url":  f"data:image/jpeg;base64,{image_base64}",
+                "url":  f"data:{file_type};base64,{image_base64}",
                 }}]})
         elif file_type == 'application/pdf':
-            # Extract text from PDF
-            pdf_text = ""
-            try:
-                pdf_reader = PdfReader(file['filepath'])
-                for page in pdf_reader.pages:
-                    pdf_text += page.extract_text()
-            except Exception as e:
-                pdf_text = "Could not extract text from PDF."
-
+            pdf_text = "\n".join(file.pdf_pages) if file.pdf_pages is not None else extract_pdf_text(file.filepath)
             messages.append({
                 "role": "user",
                 "content": f"Attached is a PDF document named {file_name}. Content:\n\"\"\"\n{pdf_text}\n\"\"\"\nPlease analyze it and include any relevant details in the evidence summary."
@@ -94,30 +113,126 @@ Additional Information:
                 "role": "user",
                 "content": f"Attached is a file named {file_name}. Please include any relevant details in the evidence summary."
             })
+    return messages
+
+def extract_pdf_text(filepath):
+    pdf_text = ""
+    with span('pdf_extract'):
+        try:
+            pdf_reader = PdfReader(filepath)
+            for page in pdf_reader.pages:
+                pdf_text += page.extract_text()
+        except Exception as e:
+            pdf_text = "Could not extract text from PDF."
+    return pdf_text
+
+def describe_evidence(file):
+    """
+    Produce a reusable text description of a single evidence file so later
+    summaries can send the description instead of the raw image or PDF.
+    Returns a dict with the extracted PDF text (if any) and the description.
+    """
+    file_type = file.mime
+    file_name = file.name
+    pdf_text = ""
+    instruction = f"Describe the attached file named {file_name} as evidence for a credit card dispute claim. Include every relevant detail such as dates, amounts, order or tracking numbers, names, and the condition of any items shown. Please be accurate more than anything else and do not hallucinate."
+    if file_type.startswith('image/'):
+        image_base64 = file.read_base64()
+        content = [{"type": "text", "text": instruction}, {
+            "type": "image_url",
+            "image_url": {
+            "url":  f"data:{file_type};base64,{image_base64}",
+            }}]
+    elif file_type == 'application/pdf':
+        if file.pdf_pages is not None:
+            # Text already extracted page by page during preprocessing
+            pdf_text = "\n".join(file.pdf_pages)
+        else:
+            pdf_text = extract_pdf_text(file.filepath)
+        content = f"{instruction}\n\nContent:\n\"\"\"\n{pdf_text}\n\"\"\""
+    else:
+        return {"pdf_text": "", "description": ""}
+
+    messages = [
+        {"role": "system", "content": "You are an assistant that describes evidence attached to credit card dispute claims."},
+        {"role": "user", "content": content}
+    ]
+    try:
+        response = client.chat.completions.create(priority=BACKGROUND, call="describe_evidence", model="gpt-4o",
+        messages=messages,
+        max_tokens=500,
+        temperature=0.0)
+        description = response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Error in describe_evidence: {e}")
+        description = ""
+    return {"pdf_text": pdf_text, "description": description}
+
+def update_structured_summary(claim, previous_data, new_answers, new_files, additional_info=""):
+    """
+    Merge only what changed since the last summary (new answers, newly uploaded
+    files, new additional info) into the previous structured summary instead of
+    regenerating it from the full claim. Returns None if the reply can't be parsed.
+    """
+    previous_summary = {key: value for key, value in previous_data.items() if key != "tracking_info"}
+    messages = [
+        {
+            "role": "system",
+            "content": "You are an assistant that helps to keep a structured summary of a credit card dispute claim up to date."
+        },
+        {
+            "role": "user",
+            "content": f"""
+Below is the current structured summary of a claim, followed by new information provided by the cardholder since it was written.
+
+Update the summary with the new information. Keep every existing field and its value unless the new information corrects or extends it. Do not remove details that came from earlier evidence. For new attachments, append a "File Name: Description" entry to "attachment_summary". Please be accurate more than anything else and do not hallucinate.
+
+Provide the full updated JSON output only, with the same structure as the current summary.
+
+Current Summary:
+{json.dumps(previous_summary, indent=2)}
+
+New User Responses:
+{json.dumps(new_answers, indent=2)}
+
+New Additional Information:
+{additional_info}
+"""
+        }
+    ]
+
+    messages.extend(build_evidence_messages(new_files))
 
-    # Add instruction to produce JSON output
     messages.append({
         "role": "assistant",
-        "content": "Please provide the structured summary in JSON format as specified."
+        "content": "Please provide the updated structured summary in JSON format as specified."
     })
 
-    # Call the OpenAI API
-    response = client.chat.completions.create(model="gpt-4o",
+    response = client.chat.completions.create(priority=BACKGROUND, call="summary_update", model="gpt-4o",
     messages=messages,
     max_tokens=1000,
     temperature=0.5,
     response_format={ "type": "json_object" })
 
-    structured_summary = response.choices[0].message.content.strip()
     try:
-        structured_data = json.loads(structured_summary)
-        shipping_info = shipping_expert_review(messages, structured_data)
-        structured_data["tracking_info"] = shipping_info
-        print(structured_data   )
+        structured_data = json.loads(response.choices[0].message.content.strip())
     except json.JSONDecodeError:
-        structured_data = {}
+        # Nothing was merged; the caller keeps the delta for the next refresh
+        return None
+
+    # Only look the shipment up again when the tracking number has changed
+    if get_tracking_number(structured_data) != get_tracking_number(previous_data) or "tracking_info" not in previous_data:
+        structured_data["tracking_info"] = shipping_expert_review(messages, structured_data)
+    else:
+        structured_data["tracking_info"] = previous_data["tracking_info"]
     return structured_data
 
+def get_tracking_number(structured_data):
+    transaction_details = structured_data.get("transaction_details")
+    if isinstance(transaction_details, dict) and "tracking_number" in transaction_details:
+        return transaction_details.get("tracking_number")
+    return structured_data.get("tracking_number")
+
 def chargeback_policies_expert_review(structured_data):
     prompt = f"""
 You are an expert on credit card chargeback policies reviewing a dispute claim.
@@ -142,7 +257,7 @@ Provide your response in JSON format:
 }}
 """
     messages = [{'role': 'system', 'content': prompt}]
-    response = client.chat.completions.create(model="gpt-4o",
+    response = client.chat.completions.create(priority=BACKGROUND, call="chargeback", model="gpt-4o",
     messages=messages,
     max_tokens=300,
     response_format={ "type": "json_object" },
@@ -153,7 +268,7 @@ Provide your response in JSON format:
         feedback = {}
     return feedback
 
-def final_adjudication(structured_data, merchant_response, expert_feedback):
+def final_adjudication(structured_data, merchant_response, expert_feedback, on_delta=None):
     prompt = f"""
 You are an adjudicator tasked with making a decision on a credit card dispute claim.
 
@@ -177,12 +292,20 @@ Provide your response in JSON format:
 }}
 """
     messages = [{'role': 'system', 'content': prompt}]
-    response = client.chat.completions.create(model="gpt-4o",
-    messages=messages,
-    max_tokens=300,
-    temperature=0.5)
+    if on_delta:
+        # Stream the reply; on_delta receives the raw JSON text as it is written
+        content = client.stream(priority=BACKGROUND, call="adjudication", on_delta=on_delta, model="gpt-4o",
+        messages=messages,
+        max_tokens=300,
+        temperature=0.5)
+    else:
+        response = client.chat.completions.create(priority=BACKGROUND, call="adjudication", model="gpt-4o",
+        messages=messages,
+        max_tokens=300,
+        temperature=0.5)
+        content = response.choices[0].message.content
     try:
-        adjudication_data = json.loads(response.choices[0].message.content.strip())
+        adjudication_data = json.loads(content.strip())
     except json.JSONDecodeError:
         adjudication_data = {}
     return adjudication_data
@@ -213,7 +336,6 @@ def shipping_expert_review(messages, structured_data):
     Extract tracking provider and tracking number from structured data,
     call the mock shipping API, and return the tracking data directly.
     """
-    print("TRTYING SHIPIPING EXPERT REVIEW")
     # Step 1: Extract tracking details
     prompt = f"""
 Extract the shipping provider and tracking number from the claim details below. If either is missing, specify "None".
@@ -229,7 +351,7 @@ Tracking provider can be one of the following: "UPS", "FedEx", "USPS", "DHL", "O
 }}
 """
     messages = [{'role': 'system', 'content': prompt}]
-    response = client.chat.completions.create(
+    response = client.chat.completions.create(priority=BACKGROUND, call="shipping",
         model="gpt-4o",
         messages=messages,
         max_tokens=200,
@@ -255,7 +377,8 @@ Tracking provider can be one of the following: "UPS", "FedEx", "USPS", "DHL", "O
         return {"data": "", "error": "Tracking number is missing."}
 
     # Step 3: Call the mock shipping API
-    tracking_info = call_shipping_api(provider, tracking_number)
+    with span('shipping_api', provider=provider):
+        tracking_info = call_shipping_api(provider, tracking_number)
     if not tracking_info or "error" in tracking_info:
         return {"data": "", "error": "Unable to retrieve shipping information from the tracking API."}
 
@@ -273,7 +396,36 @@ Tracking provider can be one of the following: "UPS", "FedEx", "USPS", "DHL", "O
         f"- Estimated Arrival: {estimated_arrival}\n"
         f"- Current Date: {current_date}"
     )
-    
-    print(formatted_info)
-    
-    return {"data": formatted_info}
\ No newline at end of file
+
+    # The raw fields too, for the local policy checks
+    shipment = {key: tracking_info[key] for key in ("shipped", "delivered", "estimated_arrival", "current_date")}
+    return {"data": formatted_info, "shipment": shipment}
+
+
+def summarize_conversation(previous_summary, conversation):
+    """
+    Fold older chat messages into the rolling summary used in place of the
+    full history in prompts.
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in conversation)
+    prompt = f"""
+You are summarizing the conversation between a cardholder and an assistant about a credit card dispute claim.
+
+Summary so far:
+{previous_summary or "None"}
+
+New messages:
+{transcript}
+
+Update the summary with the new messages. Keep every fact the cardholder has provided (dates, amounts, item details, merchant contact, shipping details) and any questions that are still unanswered. Respond with the summary text only.
+"""
+    messages = [{'role': 'system', 'content': prompt}]
+    try:
+        response = client.chat.completions.create(priority=BACKGROUND, call="context_summary", model="gpt-4o",
+        messages=messages,
+        max_tokens=500,
+        temperature=0.0)
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Error in summarize_conversation: {e}")
+        return None
@@ -0,0 +1,169 @@
+import json
+import time
+import uuid
+import logging
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('easyclaim.trace')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SLOW_SPAN_SECONDS = 1.0  # Spans slower than this are logged at INFO instead of DEBUG
+TRACE_NAMESPACE = uuid.UUID('6f1c3a52-8f0e-4d55-9a63-2c1d0b7e4a10')
+
+current_trace_id = contextvars.ContextVar('trace_id', default=None)
+recent_spans = deque(maxlen=10000)  # Finished spans, newest last, for /traces
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self.lock:
+            series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                labels = format_labels(self.label_names, key)
+                for bound, count in list(zip(self.buckets, series)) + [('+Inf', series[-1])]:
+                    bucket_labels = format_labels(self.label_names, key, ['le="%s"' % bound])
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label_names=()):
+        metric = Counter(name, help, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram('easyclaim_stage_duration_seconds', 'Time spent in each pipeline stage.', ['stage'])
+LLM_SECONDS = registry.histogram('easyclaim_llm_request_duration_seconds', 'Latency of LLM API requests, excluding time queued in the gateway.', ['call', 'model'])
+LLM_FIRST_TOKEN_SECONDS = registry.histogram('easyclaim_llm_first_token_seconds', 'Time from requesting a streamed LLM call to its first token.', ['call'])
+LLM_REQUESTS = registry.counter('easyclaim_llm_requests_total', 'LLM calls by outcome (ok, error, cache_hit).', ['call', 'outcome'])
+LLM_TOKENS = registry.counter('easyclaim_llm_tokens_total', 'Tokens used by LLM calls.', ['call', 'kind'])
+VALIDATIONS = registry.counter('easyclaim_answer_validations_total', 'Answers validated, by path (local option matching or llm).', ['path'])
+POLICY_REVIEWS = registry.counter('easyclaim_policy_reviews_total', 'Chargeback policy reviews, by path (rules or llm).', ['path'])
+SPECULATIONS = registry.counter('easyclaim_speculations_total', 'Speculative next-question evaluations by outcome (used, discarded).', ['outcome'])
+DB_SECONDS = registry.histogram('easyclaim_db_query_duration_seconds', 'Latency of database statements.', ['operation'],
+                                buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+
+def trace_id_for(claim_id):
+    # Stable per claim, so every worker and job tags the claim's spans alike
+    return uuid.uuid5(TRACE_NAMESPACE, str(claim_id)).hex
+
+
+@contextmanager
+def tracing(claim_id):
+    if claim_id is None:
+        yield current_trace_id.get()
+        return
+    token = current_trace_id.set(trace_id_for(claim_id))
+    try:
+        yield current_trace_id.get()
+    finally:
+        current_trace_id.reset(token)
+
+
+@contextmanager
+def span(stage, **labels):
+    """Times a block into the stage histogram and records it under the current trace."""
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=stage)
+        record = {'trace_id': current_trace_id.get(), 'stage': stage, 'start': start, 'duration_ms': round(duration * 1000, 2)}
+        record.update(labels)
+        recent_spans.append(record)
+        logger.log(logging.INFO if duration >= SLOW_SPAN_SECONDS else logging.DEBUG, json.dumps(record, default=str))
+
+
+def traced(stage, claim_id_of=None):
+    """
+    Decorator running the function inside a span, under the trace of the claim
+    claim_id_of(*args, **kwargs) returns.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            claim_id = claim_id_of(*args, **kwargs) if claim_id_of else None
+            with tracing(claim_id), span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_trace(trace_id):
+    return [record for record in list(recent_spans) if record['trace_id'] == trace_id]
+
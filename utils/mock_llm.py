@@ -0,0 +1,174 @@
+import re
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from utils.llm_cache import cache_key
+
+# Returned for JSON calls with no recording: covers the keys every prompt in
+# the app reads, answering so the claim flow moves forward
+DEFAULT_JSON_RESPONSE = {
+    "valid": True,
+    "clarification": "",
+    "answered": "No",
+    "answer": True,
+    "fields": [],
+    "action": "proceed_with_claim",
+    "additional_info_needed": "",
+    "decision": "human_review",
+    "rationale": "Replayed response.",
+    "tracking_provider": "",
+    "tracking_number": "",
+}
+DEFAULT_TEXT_RESPONSE = "Replayed response."
+# The question list in the batched redundancy prompt (evaluate_remaining_fields)
+BATCH_QUESTIONS_PATTERN = re.compile(r'Questions:\n(\[.*?\])\n\nRespond in JSON format: \{"fields"', re.DOTALL)
+TOKEN_CHARACTERS = 4  # Rough characters per token when splitting replies into tokens
+
+
+def parse_latency(spec):
+    """
+    Latency distribution in milliseconds: "fixed:MS", "uniform:MIN:MAX" or
+    "lognormal:MEDIAN:SIGMA". Returns a function giving a delay in seconds.
+    """
+    if not spec:
+        return lambda: 0
+    kind, *params = spec.split(':')
+    params = [float(param) for param in params]
+    if kind == 'fixed':
+        return lambda: params[0] / 1000
+    if kind == 'uniform':
+        return lambda: random.uniform(params[0], params[1]) / 1000
+    if kind == 'lognormal':
+        median, sigma = params
+        return lambda: random.lognormvariate(0, sigma) * median / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def request_key(kwargs):
+    params = {name: value for name, value in kwargs.items() if name not in ('model', 'messages', 'timeout')}
+    return cache_key(kwargs.get('model'), kwargs.get('messages', []), params)
+
+
+def default_json_response(kwargs):
+    # The batched redundancy call gets an entry for every question it asks
+    # about, as the real model gives, so replays take the same path as production
+    response = dict(DEFAULT_JSON_RESPONSE)
+    for message in reversed(kwargs.get('messages', [])):
+        match = BATCH_QUESTIONS_PATTERN.search(message.get('content') if isinstance(message.get('content'), str) else '')
+        if match:
+            response['fields'] = [{'id': question['id'], 'condition_met': True, 'answered': False, 'answer': ''}
+                                  for question in json.loads(match.group(1))]
+            break
+    return response
+
+
+def split_tokens(content):
+    return [content[index:index + TOKEN_CHARACTERS] for index in range(0, len(content), TOKEN_CHARACTERS)]
+
+
+def make_chunk(model, content=None, finish_reason=None, usage=None):
+    return ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-replay",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model or "replay",
+        "choices": [] if usage else [{
+            "index": 0,
+            "finish_reason": finish_reason,
+            "delta": {"content": content} if content is not None else {},
+        }],
+        "usage": usage,
+    })
+
+
+def make_completion(model, content):
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-replay",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "replay",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    })
+
+
+class ReplayLLMClient:
+    """
+    Offline stand-in for the OpenAI client. Replays responses recorded by
+    RecordingLLMClient (matched on the same key as the response cache) after a
+    simulated time to first token plus token_latency per token, and falls back
+    to canned responses for anything that was not recorded. stream=True
+    replays the reply token by token.
+    """
+
+    def __init__(self, recording_path=None, latency=None, token_latency=None):
+        self.recordings = {}
+        if recording_path:
+            with open(recording_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.recordings[record['key']] = record['content']
+        self.latency = parse_latency(latency)
+        self.token_latency = parse_latency(token_latency)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        time.sleep(self.latency())
+        content = self.recordings.get(request_key(kwargs))
+        if content is None:
+            if (kwargs.get('response_format') or {}).get('type') == 'json_object':
+                content = json.dumps(default_json_response(kwargs))
+            else:
+                content = DEFAULT_TEXT_RESPONSE
+        if kwargs.get('stream'):
+            return self.stream(kwargs.get('model'), content)
+        time.sleep(sum(self.token_latency() for _ in split_tokens(content)))
+        return make_completion(kwargs.get('model'), content)
+
+    def stream(self, model, content):
+        for token in split_tokens(content):
+            yield make_chunk(model, token)
+            time.sleep(self.token_latency())
+        yield make_chunk(model, finish_reason="stop")
+        yield make_chunk(model, usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+
+
+class RecordingLLMClient:
+    """Passes calls to a real client and appends every response to a JSONL file."""
+
+    def __init__(self, client, recording_path):
+        self.client = client
+        self.recording_path = recording_path
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        response = self.client.chat.completions.create(**kwargs)
+        if kwargs.get('stream'):
+            return self.record_stream(request_key(kwargs), response)
+        self.record(request_key(kwargs), response.choices[0].message.content)
+        return response
+
+    def record_stream(self, key, chunks):
+        pieces = []
+        for chunk in chunks:
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    pieces.append(choice.delta.content)
+            yield chunk
+        self.record(key, ''.join(pieces))
+
+    def record(self, key, content):
+        with self.lock:
+            with open(self.recording_path, 'a') as f:
+                f.write(json.dumps({'key': key, 'content': content}) + "\n")
@@ -0,0 +1,111 @@
+from datetime import date, datetime, timedelta
+
+from utils.answer_matching import match_option
+from utils.claim_projection import structured_field, DISPUTE_CATEGORIES
+
+ITEM_NOT_RECEIVED = 'Item not received'
+UNAUTHORIZED = 'Unauthorized transaction'
+DELIVERY_GRACE_DAYS = 10  # Days past the expected delivery date before an item counts as not received
+UNAUTHORIZED_REPORT_DAYS = 60  # Days after the transaction an unauthorized charge must be reported within
+DATE_FORMATS = ('%Y-%m-%d', '%B %d, %Y', '%b %d, %Y', '%d %B %Y', '%d %b %Y')
+NUMERIC_DATE_FORMATS = ('%m/%d/%Y', '%d/%m/%Y')  # Read both ways; a date that could be either is left undecided
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:10] if date_format == '%Y-%m-%d' else value, date_format).date()
+        except ValueError:
+            continue
+    readings = set()
+    for date_format in NUMERIC_DATE_FORMATS:
+        try:
+            readings.add(datetime.strptime(value, date_format).date())
+        except ValueError:
+            continue
+    return readings.pop() if len(readings) == 1 else None
+
+
+def policy_facts(structured_data, transaction_date=None, filed_on=None):
+    # Everything the rules look at, with None for whatever the claim doesn't say
+    tracking_info = structured_data.get('tracking_info')
+    shipment = (tracking_info.get('shipment') if isinstance(tracking_info, dict) else None) or {}
+    return {
+        'category': match_option(structured_field(structured_data, 'dispute_category') or '', DISPUTE_CATEGORIES),
+        'filed_on': parse_date(filed_on) or date.today(),
+        'transaction_date': parse_date(transaction_date) or parse_date(structured_field(structured_data, 'date_of_transaction')),
+        'delivered': shipment.get('delivered'),
+        'expected_delivery': parse_date(shipment.get('estimated_arrival')),
+        # Anything the cardholder added after a follow-up lands here, and only the LLM can weigh it
+        'has_notes': bool(str(structured_field(structured_data, 'additional_notes') or '').strip()),
+    }
+
+
+def delivery_deadline(facts):
+    return facts['expected_delivery'] + timedelta(days=DELIVERY_GRACE_DAYS)
+
+
+def report_deadline(facts):
+    return facts['transaction_date'] + timedelta(days=UNAUTHORIZED_REPORT_DAYS)
+
+
+class PolicyRule:
+    def __init__(self, name, category, applies, action, info_needed=None):
+        self.name = name
+        self.category = category
+        self.applies = applies  # facts -> whether the rule decides the claim
+        self.action = action
+        self.info_needed = info_needed  # facts -> what to ask the cardholder for
+
+    def feedback(self, facts):
+        return {
+            'action': self.action,
+            'additional_info_needed': self.info_needed(facts) if self.info_needed else '',
+            'rule': self.name,
+        }
+
+
+# Checked in order; the first rule that applies decides the claim. Claims no
+# rule decides go to the LLM review, including every claim without tracking
+# data, since the cardholder may have given the expected delivery date anywhere.
+POLICY_RULES = [
+    PolicyRule(
+        'item_arrived', ITEM_NOT_RECEIVED,
+        lambda facts: facts['delivered'] is True and not facts['has_notes'],
+        'request_additional_info',
+        lambda facts: 'Tracking shows this order was delivered. Orders that arrive late are not eligible for a chargeback. '
+                      'If you did not receive the item, please explain what happened.'),
+    PolicyRule(
+        'delivery_not_due', ITEM_NOT_RECEIVED,
+        lambda facts: facts['delivered'] is False and facts['expected_delivery'] and facts['filed_on'] < delivery_deadline(facts),
+        'wait_for_shipping'),
+    PolicyRule(
+        'delivery_overdue', ITEM_NOT_RECEIVED,
+        lambda facts: facts['delivered'] is False and facts['expected_delivery'] and facts['filed_on'] >= delivery_deadline(facts),
+        'proceed_with_claim'),
+    PolicyRule(
+        'report_window_passed', UNAUTHORIZED,
+        lambda facts: facts['transaction_date'] and facts['filed_on'] > report_deadline(facts) and not facts['has_notes'],
+        'request_additional_info',
+        lambda facts: f"Unauthorized transactions must be reported within {UNAUTHORIZED_REPORT_DAYS} days, and this one was made on "
+                      f"{facts['transaction_date'].isoformat()}. Please explain when you realized the transaction was unauthorized "
+                      f"and why it was not reported sooner."),
+]
+
+
+def precheck_policies(structured_data, transaction_date=None, filed_on=None):
+    """
+    Apply the date-based chargeback policies locally. Returns the review
+    feedback ({'action', 'additional_info_needed', 'rule'}) when a rule
+    decides the claim, or None when it needs the LLM review.
+    """
+    facts = policy_facts(structured_data or {}, transaction_date, filed_on)
+    for rule in POLICY_RULES:
+        if rule.category == facts['category'] and rule.applies(facts):
+            return rule.feedback(facts)
+    return None
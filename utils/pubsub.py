@@ -0,0 +1,51 @@
+import pickle
+import queue
+import threading
+
+import socketio
+
+# channel -> queues of the managers subscribed to it in this process
+local_channels = {}
+local_channels_lock = threading.Lock()
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """
+    In-process stand-in for a Redis/AMQP message queue. Every Socket.IO server
+    in the process using the same channel receives every emit, room join and
+    disconnect published by the others, the same way separate workers do
+    through a real broker, so multi-worker delivery can be exercised without
+    one. Messages are pickled on the way through like a broker would.
+    """
+
+    name = 'local'
+
+    def __init__(self, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.queue = queue.Queue()
+        with local_channels_lock:
+            local_channels.setdefault(channel, []).append(self.queue)
+
+    def _publish(self, data):
+        message = pickle.dumps(data)
+        with local_channels_lock:
+            subscribers = list(local_channels.get(self.channel, []))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        while True:
+            yield self.queue.get()
+
+
+def socketio_queue_options(message_queue, channel='easyclaim'):
+    """
+    SocketIO keyword arguments for the configured message queue: None for a
+    single process, "local://" for the in-process stand-in, or a broker URL
+    (redis://, amqp://, kafka://) shared by every worker.
+    """
+    if not message_queue:
+        return {}
+    if message_queue.startswith('local://'):
+        return {'client_manager': LocalPubSubManager(channel=message_queue[len('local://'):] or channel)}
+    return {'message_queue': message_queue, 'channel': channel}
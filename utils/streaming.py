@@ -0,0 +1,78 @@
+import re
+
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+def decode_partial_json_string(text, start):
+    """
+    Decode the JSON string value starting at text[start] (just after its
+    opening quote) as far as it has arrived. Stops before an incomplete escape.
+    Returns (value so far, whether the closing quote has been seen).
+    """
+    value = []
+    index = start
+    while index < len(text):
+        char = text[index]
+        if char == '"':
+            return ''.join(value), True
+        if char != '\\':
+            value.append(char)
+            index += 1
+            continue
+        if index + 1 >= len(text):
+            break
+        escape = text[index + 1]
+        if escape == 'u':
+            code = text[index + 2:index + 6]
+            if len(code) < 4:
+                break
+            value.append(chr(int(code, 16)))
+            index += 6
+        else:
+            value.append(JSON_ESCAPES.get(escape, escape))
+            index += 2
+    return ''.join(value), False
+
+
+def partial_json_field(text, field):
+    # The value of a string field in a JSON object that is still streaming in, or None
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(field), text)
+    if not match:
+        return None
+    return decode_partial_json_string(text, match.end())[0]
+
+
+class JsonFieldStream:
+    """
+    Follows a JSON object as its text streams in and calls on_delta with each
+    new piece of one string field's value as soon as it arrives. Nothing is
+    streamed until when(text so far) is true, and prefix(text so far), if
+    given, is sent ahead of the first piece.
+    """
+
+    def __init__(self, field, on_delta, when=None, prefix=None):
+        self.field = field
+        self.on_delta = on_delta
+        self.when = when
+        self.prefix = prefix
+        self.text = ''
+        self.sent = None  # Characters of the value already sent, None until streaming starts
+
+    def feed(self, piece):
+        self.text += piece
+        if self.when and not self.when(self.text):
+            return
+        value = partial_json_field(self.text, self.field)
+        if value is None:
+            return
+        if self.sent is None:
+            self.sent = 0
+            if self.prefix:
+                self.on_delta(self.prefix(self.text))
+        if len(value) > self.sent:
+            self.on_delta(value[self.sent:])
+            self.sent = len(value)
+
+    @property
+    def started(self):
+        return self.sent is not None